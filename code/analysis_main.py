@@ -20,6 +20,7 @@ Just run all the possible analyses
 """
 import os
 import sys
+import argparse
 import numpy as np
 import pandas as pd
 from collections import Counter
@@ -32,6 +33,11 @@ import workspace as ws
 import tools as tls
 import maps
 import utils as utl
+import render
+import figures
+import export
+import ranking
+import metrics
 
 
 def setup_folders():
@@ -50,6 +56,8 @@ def setup_folders():
 	for s in ['covid', 'colombia_specific', 'spain_specific']:
 		ws.folders['data/%s'%s] = os.path.join(ws.folders['data'], '%s'%s)
 	ws.folders['data/misc'] = os.path.join(pardir, 'data_misc')
+	# Cache of already processed data (not tracked by git)
+	ws.folders['data/cache'] = os.path.join(pardir, 'data_cache')
 
 
 	# Static
@@ -72,8 +80,10 @@ def setup_folders():
 	ws.data_specific = {}
 
 
-def make_graphs():
-	""" Make all the necessary graphs for the web site """
+def make_graphs(workers=1, only=None, force=False):
+	""" Make all the necessary graphs for the web site (see figures.py).
+	Only the graphs whose data changed are made, unless 'force'; 'only' is a list with the names of the graphs to make.
+	Each graph is an independent job; they are rendered in a pool of 'workers' processes (None for one per CPU) """
 
 	########################
 	# Miscellanea
@@ -88,62 +98,9 @@ def make_graphs():
 	# Top 10
 	df = ws.data
 	ws.ntop = 10
-	ws.top_ten = tls.top_n(df=ws.data_countries_only, n=ws.ntop)
+	ws.top_ten = ranking.top_n(n=ws.ntop)
 
-	########################
-	# Products for Colombia
-
-	# Get data
-	df = ws.data_specific['Colombia']
-	# Map for Colombia
-	maps.colombia_map(logscale=True)
-	# Bar plot
-	tls.horizontal_bar_plot('confirmed', df['last_date'], country='Colombia')
-	tls.top_n_time_series(
-			df=df['time_series'], 
-			n=5, 
-			key_groupby='iso', 
-			dates='fecha_obj', 
-			variable='confirmed', 
-			label='departamento', 
-			title='Serie de tiempo de los departamentos más afectados', 
-			region_label='Colombia', 
-		)
-	# sys.exit()
-
-	# New vs. active
-	tls.new_vs_active(
-			ws.dates_keys[0], 
-			ws.dates_keys[-1], 
-			x_range=(1e3, 1e6), 
-			y_range=(1e1, 1e5), 
-			variable='active', 
-			use_top_n=True, 
-			log=True
-		)
-	# Time series for the growth
-	# Top ten
-	tls.new_time_series(
-			ws.dates_keys[0], 
-			ws.dates_keys[-1], 
-			variable='new_7_days', 
-			use_top_n=True, 
-		)
-	# In log-scale
-	tls.new_time_series(
-			'15/02/2020', 
-			ws.dates_keys[-1], 
-			y_range=(10, 1e5), 
-			variable='new_7_days', 
-			use_top_n=True, 
-			log=True, 
-		)
-	# Time series for the world
-	tls.time_series_bokeh(ws.dates_keys[0], ws.dates_keys[-1])
-	# Time series for Spain and Colombia
-	tls.time_series_bokeh('01/03/2020', ws.dates_keys[-1], country='Spain')
-	tls.time_series_bokeh('01/03/2020', ws.dates_keys[-1], country='Colombia')
-	# Time series for Latin America
+	# Groups of countries
 	ws.south_american_countries = sorted([
 				'Argentina', 
 				'Brazil', 
@@ -171,33 +128,27 @@ def make_graphs():
 				'El Salvador', 
 				'Panama', 
 			])
-	tls.compare_countries(
-			'12/03/2020', 
-			ws.dates_keys[-1], 
-			variable='confirmed', 
-			countries=ws.latin_american_countries, 
-			label='paises_latinoamericanos', 
-			title_add=' en los países latinoamericanos', 
-		)
-	tls.compare_countries(
-			'12/03/2020', 
-			ws.dates_keys[-1], 
-			variable='confirmed', 
-			countries=ws.south_american_countries, 
-			label='paises_suramericanos', 
-			title_add=' en los países de Sur América', 
-		)
-	# World map
-	maps.world_map(variable='active', logscale=True)
-	if False:
-		tls.new_vs_active(ws.dates_keys[0], ws.dates_keys[-1], variable='active', country='Spain')
-		tls.new_vs_active(ws.dates_keys[0], ws.dates_keys[-1], variable='active', country='Colombia')
+
+	# Figures to build: only the ones whose data changed, unless told otherwise
+	registry = figures.declare()
+	names, signatures = figures.select(registry, only=only, force=force)
+	print('\tBuilding %i of %i figures'%(len(names), len(registry)))
+
+	# Series shared by several figures, computed once before the workers are forked
+	figures.warm_series_cache([registry[name] for name in names])
+
+	# Render them all, and report how long each one took and which ones failed
+	results = render.render([registry[name] for name in names], workers=workers)
+	render.report(results)
+	figures.record(results, signatures)
+	# The web site must load the BokehJS that matches the figures
+	export.record_bokeh_version()
 
 def num_data_for_website():
 	""" Save numerical data for the web site """
 
 	# Date of last update
-	last_date = list(ws.dates.keys())[-1]
+	last_date = ws.dates_keys[-1]
 	with open(os.path.join(ws.folders['website/static/data'], 'last_update.txt'), 'w') as f:
 		f.write(last_date)
 
@@ -344,11 +295,13 @@ def da_colombia_specific():
 		'time_series': ds2
 	}
 
-def run_analysis():
-	""" Run a sample analysis """
+def run_analysis(workers=None, only=None, force=False):
+	""" Run a sample analysis.
+	'workers' is the number of processes used for the heavy stages (None for one per CPU).
+	'only' and 'force' select the graphs to make (see make_graphs) """
 
 	# Analyze it and generate products
-	rts.read_daily_reports_JHU_CSSE()
+	rts.read_daily_reports_JHU_CSSE(workers=workers)
 
 	# Save numerical data for the web site
 	num_data_for_website()
@@ -356,9 +309,17 @@ def run_analysis():
 	# Process local data for countries
 	da_colombia_specific()
 
+	# Epidemiological metrics for all the countries and departments
+	metrics.compute_metrics()
+
 	# Make graphs
-	make_graphs()
+	make_graphs(workers=workers, only=only, force=force)
 
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Update the data and the graphs of the web site')
+	parser.add_argument('--only', nargs='+', metavar='FIGURE', help='make only these graphs (see figures.py)')
+	parser.add_argument('--force', action='store_true', help='make all the graphs, even if their data did not change')
+	parser.add_argument('--workers', type=int, default=None, help='number of processes (default: one per CPU)')
+	args = parser.parse_args()
 	setup_folders()
-	run_analysis()
\ No newline at end of file
+	run_analysis(workers=args.workers, only=args.only, force=args.force)
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+cache.py:
+Keep track of what has already been processed between runs, so that work is not repeated
+"""
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+import workspace as ws
+
+# Parquet is used for the stored dataframes if pyarrow is available; otherwise, pickle
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+
+
+
+def cache_path(name):
+	""" Path of a file inside the cache folder. The folder is created if necessary """
+	folder = ws.folders['data/cache']
+	os.makedirs(folder, exist_ok=True)
+	return os.path.join(folder, name)
+
+def temp_path(path):
+	""" Unique temporary file next to 'path', to write it and then move it into place with os.replace.
+	Processes writing the same file at the same time do not share their temporary files """
+	fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+	os.close(fd)
+	return tmp
+
+def file_hash(path, blocksize=1 << 20):
+	""" SHA-1 of the contents of a file """
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(blocksize), b''):
+			h.update(block)
+	return h.hexdigest()
+
+def arrays_hash(arrays):
+	""" SHA-1 of the contents (and shapes and types) of a list of numpy arrays (datetime64 included) """
+	h = hashlib.sha1()
+	for x in arrays:
+		x = np.ascontiguousarray(x)
+		h.update(('%s|%s\n'%(x.dtype.str, x.shape)).encode())
+		if x.dtype == object:
+			h.update(repr(x.tolist()).encode())
+		elif x.dtype.kind in 'mM':
+			# Dates and time deltas cannot be exported as a buffer; hash their integer representation
+			h.update(x.view(np.int64).data)
+		else:
+			h.update(x.data)
+	return h.hexdigest()
+
+def frame_hash(df):
+	""" SHA-1 of the contents of a dataframe, including its index and column names """
+	try:
+		rows = pd.util.hash_pandas_object(df, index=True).to_numpy()
+	except TypeError:
+		# Some cell cannot be hashed (e.g., it holds a list); use its text representation
+		return hashlib.sha1(df.to_csv().encode()).hexdigest()
+	return arrays_hash([rows, np.array([str(c) for c in df.columns], dtype=object)])
+
+def file_signature(path, previous=None):
+	""" Size, modification time and content hash of a file.
+	If 'previous' (an older signature of the same file) has the same size and mtime,
+	its hash is reused and the file is not read """
+	stat = os.stat(path)
+	signature = {
+		'path': path,
+		'size': stat.st_size,
+		'mtime': stat.st_mtime,
+	}
+	if previous is not None and previous['size'] == signature['size'] and previous['mtime'] == signature['mtime']:
+		signature['hash'] = previous['hash']
+	else:
+		signature['hash'] = file_hash(path)
+	return signature
+
+def load_manifest(name):
+	""" Load a manifest (dictionary of file signatures) from the cache folder.
+	Return an empty manifest if it does not exist or cannot be read """
+	try:
+		with open(cache_path(name), 'r') as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def save_manifest(manifest, name):
+	""" Save a manifest in the cache folder """
+	path = cache_path(name)
+	tmp = temp_path(path)
+	with open(tmp, 'w') as f:
+		json.dump(manifest, f, indent='\t')
+	os.replace(tmp, path)
+
+def changed_files(files, manifest):
+	""" Compare 'files' against the signatures stored in 'manifest'.
+	Return the new manifest and the list of files that are new or whose contents changed """
+	new_manifest = {}
+	changed = []
+	for path in files:
+		name = os.path.basename(path)
+		previous = manifest.get(name)
+		signature = file_signature(path, previous)
+		if previous is None or previous['hash'] != signature['hash']:
+			changed.append(path)
+		new_manifest[name] = signature
+	return new_manifest, changed
+
+def load_frame(name):
+	""" Load a dataframe from the cache folder. Return None if it is not there """
+	try:
+		return pd.read_pickle(cache_path(name))
+	except (OSError, ValueError, EOFError):
+		return None
+
+def save_frame(df, name):
+	""" Save a dataframe in the cache folder """
+	path = cache_path(name)
+	tmp = temp_path(path)
+	df.to_pickle(tmp, compression=None)
+	os.replace(tmp, path)
+
+def files_fingerprint(files, version=0):
+	""" Fingerprint of a list of files, based on their names, sizes and modification times.
+	It is cheap to compute because the files are not read """
+	h = hashlib.sha1(str(version).encode())
+	for path in files:
+		stat = os.stat(path)
+		h.update(('%s|%i|%f\n'%(os.path.basename(path), stat.st_size, stat.st_mtime)).encode())
+	return h.hexdigest()
+
+def save_frames(frames, fingerprint):
+	""" Store a dictionary of dataframes in columnar format, tagged with 'fingerprint'.
+	They are stored as Parquet files if pyarrow is available, or as pickles otherwise """
+	stored = {}
+	for name, df in frames.items():
+		if pyarrow is not None:
+			path = cache_path(name + '.parquet')
+			tmp = temp_path(path)
+			try:
+				df.to_parquet(tmp, engine='pyarrow', compression='snappy')
+			except (ValueError, TypeError):
+				# Some column is not supported by Parquet
+				os.remove(tmp)
+			else:
+				os.replace(tmp, path)
+				stored[name] = os.path.basename(path)
+				continue
+		save_frame(df, name + '.pkl')
+		stored[name] = name + '.pkl'
+	save_manifest({'fingerprint': fingerprint, 'files': stored}, 'frames_%s.json'%'_'.join(sorted(frames.keys())))
+
+def load_frames(names, fingerprint):
+	""" Load the dataframes stored with 'save_frames'.
+	Return them in a list with the same order as 'names', or None if they are missing or
+	were stored with a different fingerprint """
+	info = load_manifest('frames_%s.json'%'_'.join(sorted(names)))
+	if info.get('fingerprint') != fingerprint:
+		return None
+	frames = []
+	for name in names:
+		filename = info['files'].get(name)
+		if filename is None:
+			return None
+		if filename.endswith('.parquet'):
+			if pyarrow is None:
+				return None
+			try:
+				df = pd.read_parquet(cache_path(filename), engine='pyarrow')
+			except (OSError, ValueError):
+				return None
+		else:
+			df = load_frame(filename)
+			if df is None:
+				return None
+		frames.append(df)
+	return frames
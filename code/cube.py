@@ -0,0 +1,114 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+cube.py:
+Dense arrays with the time series of all the countries, so that they do not need to be filtered out of the dataframes
+"""
+import numpy as np
+
+import workspace as ws
+
+
+# Variables stored in the cube
+VARIABLES = ['confirmed', 'deaths', 'recovered', 'active', 'closed']
+
+
+
+def build_cube():
+	""" Build the cube from ws.data_countries_only.
+	The cube is indexed as [country, variable, date], so that each time series is a contiguous slice.
+	Countries with no report on a date count as zero cases, just like when filtering the dataframe """
+
+	df = ws.data_countries_only
+
+	# Labels and their indices
+	countries = sorted(set(df['country_region']))
+	country_indices = {c: i for i, c in enumerate(countries)}
+	variable_indices = {v: i for i, v in enumerate(VARIABLES)}
+
+	# Position of each row of the dataframe in the cube
+	ci = df['country_region'].map(country_indices).to_numpy()
+	di = np.searchsorted(ws.dates_array, df['date'].to_numpy().astype('datetime64[D]'))
+
+	# Fill up the cube
+	cube = np.zeros((len(countries), len(VARIABLES), len(ws.dates_array)), dtype=np.int64)
+	for variable, v in variable_indices.items():
+		cube[ci, v, di] = df[variable].fillna(0).to_numpy()
+
+	# Save to the workspace
+	ws.cube = cube
+	ws.cube_countries = countries
+	ws.cube_country_indices = country_indices
+	ws.cube_variable_indices = variable_indices
+	# The world is the sum of all the countries
+	ws.cube_world = cube.sum(axis=0)
+
+def get_series(country, variable, start_index, end_index):
+	""" Time series of 'variable' for 'country' (or the whole world), from 'start_index' to 'end_index' (both included) """
+	v = ws.cube_variable_indices[variable]
+	if country == 'world':
+		return ws.cube_world[v, start_index:end_index + 1]
+	try:
+		i = ws.cube_country_indices[country]
+	except KeyError:
+		# Country without data
+		return np.zeros(end_index - start_index + 1, dtype=ws.cube.dtype)
+	return ws.cube[i, v, start_index:end_index + 1]
+
+def get_matrix(countries, variable, start_index, end_index):
+	""" Time series of 'variable' for a list of countries (which may include 'world'), as a 2D array [country, date] """
+	v = ws.cube_variable_indices[variable]
+	matrix = np.zeros((len(countries), end_index - start_index + 1), dtype=ws.cube.dtype)
+	rows = np.array([ws.cube_country_indices.get(c, -1) for c in countries], dtype=np.int64)
+	found = rows >= 0
+	matrix[found] = ws.cube[rows[found], v, start_index:end_index + 1]
+	for i, country in enumerate(countries):
+		if country == 'world':
+			matrix[i] = ws.cube_world[v, start_index:end_index + 1]
+	return matrix
+
+def get_dates(start_index, end_index):
+	""" Dates (as datetime64[D]) from 'start_index' to 'end_index' (both included) """
+	return ws.dates_array[start_index:end_index + 1]
+
+def day_zero(matrix, n):
+	""" For each row of a 2D array of cumulative cases [country, date], the index of the first date with 'n' cases or more.
+	Rows that never reach 'n' get the number of dates. It is found by counting the dates whose running maximum is below 'n',
+	for all the rows at once; the running maximum never decreases, so corrections that lower the cases are ignored """
+	running_max = np.maximum.accumulate(matrix, axis=-1)
+	return (running_max < n).sum(axis=-1)
+
+def align(matrix, day0):
+	""" Shift each row of 'matrix' [country, date] so that it starts at its own 'day0'.
+	Return a float array [country, days since day 0] padded with NaN after the end of each row.
+	Rows whose day 0 is past the last date are all NaN """
+	ndates = matrix.shape[-1]
+	length = max(ndates - int(day0.min()), 0) if len(day0) else 0
+	indices = day0[:, np.newaxis] + np.arange(length)[np.newaxis, :]
+	valid = indices < ndates
+	values = np.take_along_axis(matrix, np.minimum(indices, ndates - 1), axis=-1)
+	return np.where(valid, values, np.nan)
+
+def days_since(n, countries=None, variable='confirmed'):
+	""" Time series of 'variable' for 'countries' (all of them if None) aligned to the day each one reached 'n' confirmed cases.
+	Return the countries, their day 0 (index in ws.dates_array) and the NaN-padded array [country, days since day 0] """
+	if countries is None:
+		countries = ws.cube_countries
+	countries = list(countries)
+	end_index = len(ws.dates_array) - 1
+	day0 = day_zero(get_matrix(countries, 'confirmed', 0, end_index), n)
+	return countries, day0, align(get_matrix(countries, variable, 0, end_index), day0)
@@ -0,0 +1,109 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+downsample.py:
+Reduce the number of points of a series keeping its shape, so that the figures do not grow with the length of the pandemic.
+The functions return the indices of the points to keep, which always include the first and the last ones
+"""
+import numpy as np
+
+
+# Points per figure if no other budget is given
+POINT_BUDGET = 6000
+# Fewest points kept for a series
+MIN_POINTS = 30
+
+
+
+def as_float(x):
+	""" Values of 'x' as floats (dates become days since the epoch) """
+	x = np.asarray(x)
+	if x.dtype.kind == 'M':
+		return x.astype('datetime64[D]').astype(float)
+	if x.dtype == object:
+		return np.array([v.toordinal() if hasattr(v, 'toordinal') else v for v in x], dtype=float)
+	return x.astype(float)
+
+def bucket_edges(n, nbuckets):
+	""" Edges of 'nbuckets' buckets splitting the points between the first and the last one """
+	return np.linspace(1, n - 1, nbuckets + 1).astype(np.int64)
+
+def lttb(x, y, n):
+	""" Indices of the 'n' points chosen by Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+	In each bucket, the point forming the largest triangle with the previous chosen point and the mean of the next bucket is kept """
+	x = as_float(x)
+	y = as_float(y)
+	npoints = len(x)
+	if n >= npoints or npoints <= 2:
+		return np.arange(npoints)
+	if n < 3:
+		return np.array([0, npoints - 1])
+	edges = bucket_edges(npoints, n - 2)
+	indices = np.empty(n, dtype=np.int64)
+	indices[0] = 0
+	indices[-1] = npoints - 1
+	a = 0
+	for i in range(n - 2):
+		start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+		# Mean of the next bucket (the last point for the last bucket)
+		if i == n - 3:
+			next_x, next_y = x[-1], y[-1]
+		else:
+			next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+			next_x, next_y = np.nanmean(x[next_start:next_end]), np.nanmean(y[next_start:next_end])
+		area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+		area = np.where(np.isnan(area), -1., area)
+		a = start + int(np.argmax(area))
+		indices[i + 1] = a
+	return indices
+
+def minmax(x, y, n):
+	""" Indices of the minimum and maximum of 'y' in each of n / 2 buckets, plus the first and last points """
+	y = as_float(y)
+	npoints = len(y)
+	if n >= npoints or npoints <= 2:
+		return np.arange(npoints)
+	nbuckets = max((n - 2) // 2, 1)
+	edges = bucket_edges(npoints, nbuckets)
+	indices = [0, npoints - 1]
+	for start, end in zip(edges[:-1], edges[1:]):
+		end = max(end, start + 1)
+		segment = y[start:end]
+		if np.all(np.isnan(segment)):
+			continue
+		indices += [start + int(np.nanargmin(segment)), start + int(np.nanargmax(segment))]
+	return np.unique(indices)
+
+METHODS = {'lttb': lttb, 'minmax': minmax}
+
+def take(values, indices):
+	""" Elements 'indices' of an array or a list """
+	if isinstance(values, np.ndarray):
+		return values[indices]
+	return [values[i] for i in indices]
+
+def series_dict(data, x, y, n, method='lttb'):
+	""" Downsample a dictionary of columns {column: values} describing a single series, choosing the points with 'x' and 'y'.
+	Return a new dictionary with all the columns reduced to the same points """
+	indices = METHODS[method](data[x], data[y], n)
+	if len(indices) == len(data[x]):
+		return data
+	return {k: take(v, indices) for k, v in data.items()}
+
+def per_series(budget, nseries):
+	""" Points per series for a figure with a 'budget' of points shared by 'nseries' series """
+	return max(budget // max(nseries, 1), MIN_POINTS)
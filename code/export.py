@@ -0,0 +1,205 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+export.py:
+Save the Bokeh figures for the web site. Each figure can be saved as:
+	'html': a standalone HTML document, with its own copy of BokehJS
+	'json': a json_item payload (same name, .json), to be embedded in a page that loads BokehJS once
+	'split': like 'json', but the data of the figure goes to a separate file (.data.json) that the page loads at runtime.
+		The layout (.json) is only written when ws.write_layout is True, so daily updates only rewrite the data.
+		Long series are downsampled to a budget of ws.point_budget points per figure (see downsample.py);
+		the full data then goes to .full.data.json, which the page loads when the user zooms in.
+		Figures with GeoJSON sources (maps) and layouts of several models cannot be split and are saved as in 'json'
+The modes in use are in ws.export_modes (EXPORT_MODES by default). 'split' and 'json' write the same .json file,
+so only one of them should be used
+"""
+import os
+import json
+import math
+import datetime
+import numpy as np
+
+import bokeh
+from bokeh.embed import json_item
+from bokeh.io import output_file, save
+from bokeh.models import ColumnDataSource, GeoJSONDataSource
+
+import workspace as ws
+import downsample
+
+
+# Export modes used if ws.export_modes is not set
+EXPORT_MODES = ['split']
+
+
+
+def modes():
+	""" Export modes in use """
+	return getattr(ws, 'export_modes', EXPORT_MODES)
+
+def output_names(filename):
+	""" Names of the files written for a figure saved as 'filename' (an .html name) in the current modes """
+	base, _ = os.path.splitext(filename)
+	names = []
+	if 'html' in modes():
+		names.append(filename)
+	if 'json' in modes() or 'split' in modes():
+		names.append(base + '.json')
+	if 'split' in modes():
+		names.append(base + '.data.json')
+	return names
+
+def save_figure(p, path):
+	""" Save the Bokeh figure 'p' to 'path' (an .html path) in the current modes """
+	base, _ = os.path.splitext(path)
+	if 'html' in modes():
+		output_file(path)
+		save(p)
+	if 'split' in modes():
+		save_split(p, base)
+	elif 'json' in modes():
+		write_json(json_item(p), base + '.json')
+
+def write_json(obj, path):
+	""" Write 'obj' as compact JSON """
+	with open(path, 'w') as f:
+		json.dump(obj, f, separators=(',', ':'), allow_nan=False)
+
+def compact(values):
+	""" Turn the values of a data column into plain JSON values: lists instead of arrays, dates as milliseconds
+	since the epoch (as Bokeh uses them) and None instead of NaN """
+	if isinstance(values, np.ndarray):
+		if values.dtype.kind == 'M':
+			return compact(values.astype('datetime64[ms]').astype(np.int64).astype(float))
+		values = values.tolist()
+	if isinstance(values, (list, tuple)):
+		return [compact(v) for v in values]
+	if isinstance(values, float) and math.isnan(values):
+		return None
+	if isinstance(values, datetime.datetime):
+		return values.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000.
+	if isinstance(values, datetime.date):
+		return datetime.datetime(values.year, values.month, values.day, tzinfo=datetime.timezone.utc).timestamp() * 1000.
+	if isinstance(values, np.generic):
+		return compact(values.item())
+	return values
+
+def renderer_sources(p):
+	""" Data sources of the renderers of 'p', in the order of the renderers, without repetitions """
+	sources = []
+	for renderer in p.renderers:
+		source = getattr(renderer, 'data_source', None)
+		if source is not None and source not in sources:
+			sources.append(source)
+	return sources
+
+def field_name(spec):
+	""" Name of the data column used by a glyph property, or None if it is not a column """
+	if isinstance(spec, str):
+		return spec
+	if isinstance(spec, dict):
+		return spec.get('field')
+	return getattr(spec, 'field', None)
+
+def runs(labels):
+	""" (start, end) of the runs of equal consecutive values in 'labels' """
+	bounds = [0] + [i for i in range(1, len(labels)) if labels[i] != labels[i - 1]] + [len(labels)]
+	return list(zip(bounds[:-1], bounds[1:]))
+
+def concatenate(parts):
+	""" Join a list of arrays or lists """
+	if all(isinstance(part, np.ndarray) for part in parts):
+		return np.concatenate(parts)
+	return [v for part in parts for v in part]
+
+def downsampled_sources(p, sources, budget):
+	""" Downsampled data of the sources of 'p' with more points than allowed by 'budget'.
+	multi_line sources are reduced line by line; the rest, series by series (their runs of 'country', or as a whole).
+	Return a dictionary {source: data} with the sources that changed """
+	# How each source is drawn
+	plans = {}
+	for renderer in p.renderers:
+		source = getattr(renderer, 'data_source', None)
+		glyph = getattr(renderer, 'glyph', None)
+		if not isinstance(source, ColumnDataSource) or source in plans or glyph is None:
+			continue
+		xs, ys = field_name(getattr(glyph, 'xs', None)), field_name(getattr(glyph, 'ys', None))
+		x, y = field_name(getattr(glyph, 'x', None)), field_name(getattr(glyph, 'y', None))
+		if xs in source.data and ys in source.data:
+			plans[source] = ('lines', xs, ys, None)
+		elif x in source.data and y in source.data:
+			series = runs(list(source.data['country'])) if 'country' in source.data else [(0, len(source.data[x]))]
+			plans[source] = ('points', x, y, series)
+	# Points per series
+	nseries = 0
+	for source, (kind, x, y, series) in plans.items():
+		nseries += len(source.data[x]) if kind == 'lines' else len(series)
+	npoints = downsample.per_series(budget, nseries)
+	# Downsample
+	changed = {}
+	for source, (kind, x, y, series) in plans.items():
+		data = dict(source.data)
+		if kind == 'lines':
+			reduced = [downsample.series_dict({x: a, y: b}, x, y, npoints) for a, b in zip(data[x], data[y])]
+			if any(len(r[x]) < len(a) for r, a in zip(reduced, data[x])):
+				data[x] = [r[x] for r in reduced]
+				data[y] = [r[y] for r in reduced]
+				changed[source] = data
+		elif any(end - start > npoints for start, end in series):
+			parts = [downsample.series_dict({k: v[start:end] for k, v in data.items()}, x, y, npoints) for start, end in series]
+			changed[source] = {k: concatenate([part[k] for part in parts]) for k in data.keys()}
+	return changed
+
+def save_split(p, base):
+	""" Save the data of the figure 'p' to 'base'.data.json and, if ws.write_layout, its layout (with empty sources) to 'base'.json.
+	The sources are named after the file and their order, so that the page can fill them in """
+	if not hasattr(p, 'renderers'):
+		# A layout of several models (e.g., a figure with widgets): saved whole, like the maps
+		write_json({'title': None, 'sources': {}}, base + '.data.json')
+		write_json(json_item(p), base + '.json')
+		return
+	sources = renderer_sources(p)
+	data = {'title': p.title.text if p.title is not None else None, 'sources': {}}
+	if any(isinstance(s, GeoJSONDataSource) for s in sources):
+		# The data goes with the layout; the data file is empty
+		write_json(data, base + '.data.json')
+		write_json(json_item(p), base + '.json')
+		return
+	name = os.path.basename(base)
+	budget = getattr(ws, 'point_budget', downsample.POINT_BUDGET)
+	reduced = downsampled_sources(p, sources, budget) if budget is not None else {}
+	full = dict(data, sources={})
+	data['full'] = bool(reduced)
+	for i, source in enumerate(s for s in sources if isinstance(s, ColumnDataSource)):
+		source.name = '%s/%i'%(name, i)
+		data['sources'][source.name] = {k: compact(v) for k, v in reduced.get(source, source.data).items()}
+		if reduced:
+			full['sources'][source.name] = {k: compact(v) for k, v in source.data.items()}
+		source.data = {k: [] for k in source.data.keys()}
+	p.name = '%s/figure'%name
+	write_json(data, base + '.data.json')
+	if reduced:
+		write_json(full, base + '.full.data.json')
+	if getattr(ws, 'write_layout', True):
+		write_json(json_item(p), base + '.json')
+
+def record_bokeh_version():
+	""" Write the version of Bokeh that exported the figures to static/data/bokeh_version.txt,
+	so that the web site loads the same version of BokehJS (see website/web_main.py) """
+	path = os.path.join(ws.folders['website/static/data'], 'bokeh_version.txt')
+	with open(path, 'w') as f:
+		f.write(bokeh.__version__)
@@ -0,0 +1,306 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+figures.py:
+Registry of the figures of the web site. Each figure declares its producer, its parameters, its output files
+and the data it depends on, so that only the figures whose inputs changed need to be rebuilt.
+The dependencies are:
+	'jhu': daily reports of JHU CSSE (world data)
+	'colombia': case lines of Colombia
+	'world_shapefile': shapefile of the countries of the world
+	'colombia_shapefile': shapefile of the Colombian departments
+The source files of the producer and of the modules it uses (and the version of Bokeh) are always a dependency too. Dependencies are compared by the hash of their contents,
+so a figure is skipped entirely when the data behind it is the same as in the last run
+"""
+import os
+import sys
+import types
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+import bokeh
+from collections import OrderedDict
+
+import workspace as ws
+import cache
+import render
+import export
+import tools as tls
+import maps
+
+
+# Name of the manifest with the signatures of the figures built in the last runs
+MANIFEST = 'figures_manifest.json'
+# Version of the rendering. Change it to rebuild all the figures
+RENDER_VERSION = 1
+
+
+
+def figure(name, producer, outputs, depends, *args, **kwargs):
+	""" Declare a figure: a render job (see render.job) with its output files (in the images folder) and dependencies.
+	The Bokeh outputs are given by their .html names; the files actually written depend on the export modes (see export.py) """
+	fig = render.job(name, producer, *args, **kwargs)
+	fig['outputs'] = [o for f in outputs for o in (export.output_names(f) if f.endswith('.html') else [f])]
+	fig['depends'] = depends
+	return fig
+
+def data_in_layout(fig):
+	""" Mark that the layout of a figure (not only its data sources) depends on its data, e.g. through categorical ranges,
+	fixed legends or color bars. Its layout is then rewritten whenever its data changes """
+	fig['layout_depends'] = list(fig['depends'])
+	return fig
+
+def files_with_prefix(folder, prefix):
+	""" Sorted list of the files in 'folder' whose names start with 'prefix' """
+	return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.startswith(prefix))
+
+def dependency_fingerprints():
+	""" Hashes of the contents of each dependency: the arrays and dataframes in the workspace for the data,
+	and the files for the shapefiles. A dependency whose files were touched but whose contents are the same keeps its hash """
+	misc = ws.folders['data/misc']
+	colombia = ws.data_specific['Colombia']
+	return {
+		'jhu': cache.arrays_hash([ws.cube, ws.dates_array, np.array(ws.cube_countries, dtype=object)]),
+		'colombia': cache.arrays_hash([np.array([cache.frame_hash(colombia[k]) for k in sorted(colombia.keys())], dtype=object)]),
+		'world_shapefile': files_hash(files_with_prefix(os.path.join(misc, 'countries'), 'ne_110m_admin_0_countries.')),
+		'colombia_shapefile': files_hash(files_with_prefix(os.path.join(misc, 'departamentos_colombia'), 'departamentos_colombia.')),
+	}
+
+def files_hash(files):
+	""" Hash of the contents of a list of files """
+	return cache.arrays_hash([np.array([cache.file_hash(f) for f in files], dtype=object)])
+
+def params_signature(fig, layout=False):
+	""" Hash of the producer and parameters of a figure.
+	Dataframes are left out (their contents are covered by the dependencies).
+	If 'layout', the last date is left out too: it only affects the data and the title, which go with the data """
+	def describe(value):
+		if isinstance(value, (pd.DataFrame, pd.Series)):
+			return '<%s>'%type(value).__name__
+		if layout and isinstance(value, str) and value == ws.dates_keys[-1]:
+			return '<last date>'
+		return repr(value)
+	items = [fig['function'].__module__, fig['function'].__name__, 'modes=%s'%','.join(export.modes())]
+	items += [describe(a) for a in fig['args']]
+	items += ['%s=%s'%(k, describe(v)) for k, v in sorted(fig['kwargs'].items())]
+	return hashlib.sha1('\n'.join(items).encode()).hexdigest()
+
+def code_modules(module_name):
+	""" Names of the modules of this folder used by the module 'module_name', directly or through other modules of
+	this folder (imported as modules or through their functions and classes), including itself """
+	folder = os.path.dirname(os.path.abspath(__file__))
+	modules = set()
+	pending = [module_name]
+	while pending:
+		name = pending.pop()
+		path = getattr(sys.modules.get(name), '__file__', None)
+		if name in modules or path is None or os.path.dirname(os.path.abspath(path)) != folder:
+			continue
+		modules.add(name)
+		for value in vars(sys.modules[name]).values():
+			if isinstance(value, types.ModuleType):
+				pending.append(value.__name__)
+			elif callable(value) and isinstance(getattr(value, '__module__', None), str):
+				pending.append(value.__module__)
+	return sorted(modules)
+
+@functools.lru_cache(maxsize=None)
+def code_hash(module_name):
+	""" Hash of the source files of the modules used by the module 'module_name' (see code_modules) """
+	files = [sys.modules[name].__file__ for name in code_modules(module_name)]
+	return hashlib.sha1('\n'.join(cache.file_hash(f) for f in files).encode()).hexdigest()
+
+def signature(fig, fingerprints):
+	""" Signature of a figure: the fingerprints of its dependencies (and code) and of its parameters,
+	and the signature of its layout, which only changes with the code, the parameters and the dependencies in 'layout_depends'.
+	The code is the module of the producer and all the modules of this folder that it uses (export.py, cube.py...) """
+	code = '%i:%s:%s'%(RENDER_VERSION, bokeh.__version__, code_hash(fig['function'].__module__))
+	depends = {d: fingerprints[d] for d in fig['depends']}
+	depends['code'] = code
+	layout = [code, params_signature(fig, layout=True)] + [fingerprints[d] for d in fig.get('layout_depends', [])]
+	return {'depends': depends, 'params': params_signature(fig), 'layout': hashlib.sha1('\n'.join(layout).encode()).hexdigest()}
+
+def declare():
+	""" Declare all the figures of the web site. The workspace must hold the data already.
+	Return them in an ordered dictionary {name: figure} """
+
+	last = ws.dates_keys[-1]
+	df = ws.data_specific['Colombia']
+
+	figures = [
+		########################
+		# Products for Colombia
+		# Map for Colombia
+		data_in_layout(figure('colombia_map', maps.colombia_map, ['colombia_map_log.html'], ['colombia', 'colombia_shapefile'], logscale=True)),
+		# Bar plot
+		data_in_layout(figure('colombia_hbarplot', tls.horizontal_bar_plot, ['colombia_hbarplot.html'], ['colombia'], 'confirmed', df['last_date'], country='Colombia')),
+		data_in_layout(figure(
+				'colombia_time_series',
+				tls.top_n_time_series,
+				['colombia_time_series__v1.png', 'colombia_time_series__v1.html'],
+				['colombia'],
+				df=df['time_series'],
+				n=5,
+				key_groupby='iso',
+				dates='fecha_obj',
+				variable='confirmed',
+				label='departamento',
+				title='Serie de tiempo de los departamentos más afectados',
+				region_label='Colombia',
+			)),
+
+		########################
+		# World
+		# New vs. active
+		figure(
+				'new_vs_active_top_n',
+				tls.new_vs_active,
+				['new_vs_active_last7days_world.html', 'new_vs_active_last7days_top_n%01i_logscale.html'%ws.ntop],
+				['jhu'],
+				ws.dates_keys[0],
+				last,
+				x_range=(1e3, 1e6),
+				y_range=(1e1, 1e5),
+				variable='active',
+				use_top_n=True,
+				log=True
+			),
+		# Time series for the growth
+		# Top ten
+		figure(
+				'new_time_series_top_n',
+				tls.new_time_series,
+				['new_7_days_vs_date_world.html', 'new_7_days_vs_date_top_n%01i_.html'%ws.ntop],
+				['jhu'],
+				ws.dates_keys[0],
+				last,
+				variable='new_7_days',
+				use_top_n=True,
+			),
+		# In log-scale
+		figure(
+				'new_time_series_top_n_logscale',
+				tls.new_time_series,
+				['new_7_days_vs_date_world_logscale.html', 'new_7_days_vs_date_top_n%01i_logscale.html'%ws.ntop],
+				['jhu'],
+				'15/02/2020',
+				last,
+				y_range=(10, 1e5),
+				variable='new_7_days',
+				use_top_n=True,
+				log=True,
+			),
+		# Time series for the world
+		figure('world_time_series', tls.time_series_bokeh, ['world_graph.html'], ['jhu'], ws.dates_keys[0], last),
+		# Time series for Spain and Colombia
+		figure('spain_time_series', tls.time_series_bokeh, ['spain_graph.html'], ['jhu'], '01/03/2020', last, country='Spain'),
+		figure('colombia_country_time_series', tls.time_series_bokeh, ['colombia_graph.html'], ['jhu'], '01/03/2020', last, country='Colombia'),
+		# Time series for Latin America
+		figure(
+				'latin_america_time_series',
+				tls.compare_countries,
+				['paises_latinoamericanos_confirmed_time_series.html'],
+				['jhu'],
+				'12/03/2020',
+				last,
+				variable='confirmed',
+				countries=ws.latin_american_countries,
+				label='paises_latinoamericanos',
+				title_add=' en los países latinoamericanos',
+			),
+		figure(
+				'south_america_time_series',
+				tls.compare_countries,
+				['paises_suramericanos_confirmed_time_series.html'],
+				['jhu'],
+				'12/03/2020',
+				last,
+				variable='confirmed',
+				countries=ws.south_american_countries,
+				label='paises_suramericanos',
+				title_add=' en los países de Sur América',
+			),
+		# World map
+		data_in_layout(figure('world_map', maps.world_map, ['world_map_log.html'], ['jhu', 'world_shapefile'], variable='active', logscale=True)),
+		# Animated world map
+		data_in_layout(figure('world_map_animated', maps.world_map_animated, ['world_map_animated_log.html'], ['jhu', 'world_shapefile'], '01/03/2020', last, variable='active', logscale=True)),
+	]
+
+	# Each file must be written by a single figure, or the figures would overwrite each other
+	owners = {}
+	for fig in figures:
+		for output in fig['outputs']:
+			if output in owners:
+				raise ValueError('Figures %s and %s both write %s'%(owners[output], fig['name'], output))
+			owners[output] = fig['name']
+
+	return OrderedDict((fig['name'], fig) for fig in figures)
+
+def select(figures, only=None, force=False):
+	""" Names of the figures to build.
+	If 'only' (a list of names) is given, just those; if 'force', all of them.
+	Otherwise, the ones whose signature changed since they were last built or whose outputs are missing.
+	Each figure gets a 'layout' flag telling whether its layout must be written (see export.save_split).
+	Return the names and the current signatures of all the figures """
+	fingerprints = dependency_fingerprints()
+	signatures = {name: signature(fig, fingerprints) for name, fig in figures.items()}
+	manifest = cache.load_manifest(MANIFEST)
+	images = ws.folders['website/static/images']
+	stale = []
+	for name, fig in figures.items():
+		missing = any(not os.path.exists(os.path.join(images, f)) for f in fig['outputs'])
+		previous = manifest.get(name, {})
+		# The layout is written again only if it changed (or some file is missing)
+		fig['layout'] = force or missing or previous.get('layout') != signatures[name]['layout']
+		if missing or previous != signatures[name]:
+			stale.append(name)
+	if only is not None:
+		unknown = sorted(set(only) - set(figures.keys()))
+		if unknown:
+			raise ValueError('Unknown figures: %s'%', '.join(unknown))
+		return [name for name in figures if name in only], signatures
+	if force:
+		return list(figures.keys()), signatures
+	return stale, signatures
+
+def warm_series_cache(figures):
+	""" Compute the time series that 'figures' take from the series cache (see series_cache.py) in this process.
+	Each forked worker gets its own copy of the cache, so the series that several figures share must be cached
+	before the workers are forked, or each worker would compute them again """
+	for fig in figures:
+		if fig['function'] not in (tls.new_vs_active, tls.new_time_series, tls.time_series_bokeh, tls.compare_countries):
+			continue
+		start_index, end_index = tls.get_start_end(*fig['args'][:2])
+		kwargs = fig['kwargs']
+		if fig['function'] is tls.compare_countries:
+			for country in kwargs['countries']:
+				tls.get_single_time_series(country, kwargs.get('variable', 'confirmed'), start_index, end_index)
+			continue
+		countries = [kwargs.get('country', 'world')]
+		if fig['function'] is not tls.time_series_bokeh and countries == ['world']:
+			# All the countries (or the top ones) are drawn too
+			countries += list(ws.top_ten if kwargs.get('use_top_n') else ws.cube_countries)
+		tls.get_new_7_days_many(start_index, end_index, countries=countries, avg=True)
+
+def record(results, signatures):
+	""" Store the signatures of the figures that were built without errors """
+	manifest = cache.load_manifest(MANIFEST)
+	for r in results:
+		if r['error'] is None:
+			manifest[r['name']] = signatures[r['name']]
+	cache.save_manifest(manifest, MANIFEST)
@@ -23,35 +23,171 @@ import itertools
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+import shapely.errors
+import shapely.geometry
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
 from bokeh.plotting import figure, save
-from bokeh.models import Slider, HoverTool, Range1d, NumeralTickFormatter, DatetimeTickFormatter, GeoJSONDataSource, LinearColorMapper, LogColorMapper, ColorBar, BasicTicker, LogTicker, FixedTicker
+from bokeh.models import Slider, DateSlider, Button, CustomJS, ColumnDataSource, HoverTool, Range1d, NumeralTickFormatter, DatetimeTickFormatter, GeoJSONDataSource, LinearColorMapper, LogColorMapper, ColorBar, BasicTicker, LogTicker, FixedTicker
 from bokeh.io import show, output_file, curdoc
 from bokeh.palettes import brewer, Spectral11, Category20, Category10
 from bokeh.layouts import widgetbox, row, column
 
 import workspace as ws
 import utils as utl
+import cache
+import export
+import cube
+import tools as tls
+
+
+# Version of the cleaning of the shapefiles. Change it to discard the cached geometries
+SHAPES_VERSION = 2
+# Tolerances (in degrees) of the simplified geometries precomputed for each shapefile, from finest to coarsest
+SIMPLIFY_TOLERANCES = [0.01, 0.03, 0.1, 0.3]
+# Decimals of the coordinates in the GeoJSON of the maps (the finest geometries are snapped to a grid of 0.005 degrees)
+COORD_PRECISION = 3
+# Milliseconds between frames of the animated maps
+FRAME_INTERVAL = 150
+
+# Show the date chosen in the slider of an animated map: take the values of that date from the country x date array
+SLIDER_JS = """
+var i = Math.max(0, Math.min(Math.round((slider.value - start) / 86400000), ndates - 1));
+var v = values.data['values'];
+var column = new Array(ncountries);
+for (var k = 0; k < ncountries; k++) {
+	column[k] = v[k * ndates + i];
+}
+geosource.data[variable] = column;
+geosource.change.emit();
+var date = new Date(start + i * 86400000);
+function pad(x) { return (x < 10 ? '0' : '') + x; }
+p.title.text = title + pad(date.getUTCDate()) + '/' + pad(date.getUTCMonth() + 1) + '/' + date.getUTCFullYear();
+"""
+# Play and pause the animation of a map by moving its slider one day per frame
+PLAY_JS = """
+if (button._timer) {
+	clearInterval(button._timer);
+	button._timer = null;
+	button.label = '\u25B6';
+	return;
+}
+if (slider.value >= slider.end) {
+	slider.value = slider.start;
+}
+button.label = '\u275A\u275A';
+button._timer = setInterval(function () {
+	if (slider.value >= slider.end) {
+		clearInterval(button._timer);
+		button._timer = null;
+		button.label = '\u25B6';
+		return;
+	}
+	slider.value = Math.min(slider.value + 86400000, slider.end);
+}, interval);
+"""
 
-
-
-def colombia_map(variable='confirmed', logscale=False):
-	"""
-	Interactive Colombian map in bokeh figure
-	"""
-
-	shapefile = os.path.join(ws.folders['data/misc'], 'departamentos_colombia/departamentos_colombia.shp')
-
-	# Read shapefile using Geopandas
-	gdf = gpd.read_file(shapefile)
-
+# Geometries already loaded in this process: {name: (fingerprint, GeoDataFrame)}
+_shapes = {}
+
+
+
+def shapefile_files(shapefile):
+	""" Files that make up a shapefile (.shp, .shx, .dbf, .prj...) """
+	folder, name = os.path.split(shapefile)
+	stem = os.path.splitext(name)[0] + '.'
+	return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.startswith(stem))
+
+def load_shapes(name, shapefile, clean):
+	""" Read a shapefile and clean it with the function 'clean' (GeoDataFrame -> GeoDataFrame).
+	The simplified geometries for each of SIMPLIFY_TOLERANCES are added as columns 'geometry_<i>' (see shapes_for).
+	The result is kept in memory and pickled in the cache folder, keyed by the sizes and modification times of the files
+	of the shapefile and by SHAPES_VERSION, SIMPLIFY_TOLERANCES and COORD_PRECISION, so the shapefile is only parsed again when it changes. The GeoDataFrame is shared: do not modify it """
+	# The settings of the simplification are part of the key, so changing them discards the cached geometries
+	version = '%i|%r|%i'%(SHAPES_VERSION, SIMPLIFY_TOLERANCES, COORD_PRECISION)
+	fingerprint = cache.files_fingerprint(shapefile_files(shapefile), version=version)
+	if name in _shapes and _shapes[name][0] == fingerprint:
+		return _shapes[name][1]
+	manifest_name = 'shapes_%s.json'%name
+	gdf = None
+	if cache.load_manifest(manifest_name).get('fingerprint') == fingerprint:
+		gdf = cache.load_frame(name + '.pkl')
+	if gdf is None:
+		gdf = clean(gpd.read_file(shapefile))
+		for i, tolerance in enumerate(SIMPLIFY_TOLERANCES):
+			gdf['geometry_%i'%i] = simplify(gdf.geometry, tolerance)
+		cache.save_frame(gdf, name + '.pkl')
+		cache.save_manifest({'fingerprint': fingerprint}, manifest_name)
+	_shapes[name] = (fingerprint, gdf)
+	return gdf
+
+def simplify(geometry, tolerance):
+	""" Simplify a GeoSeries with 'tolerance' and snap its coordinates to a grid of half the tolerance.
+	If possible, the geometries are simplified as a coverage (shapely >= 2.1), so the borders shared by neighbours
+	are simplified once and stay shared; otherwise, each geometry is simplified on its own, keeping it valid.
+	Geometries that would vanish in the grid are kept without snapping. Return a GeoSeries """
+	try:
+		simplified = shapely.coverage_simplify(np.asarray(geometry), tolerance)
+	except (AttributeError, shapely.errors.GEOSException):
+		simplified = np.asarray(geometry.simplify(tolerance, preserve_topology=True))
+	try:
+		snapped = shapely.set_precision(simplified, tolerance / 2.)
+		simplified = np.where(shapely.is_empty(snapped), simplified, snapped)
+	except AttributeError:
+		# shapely < 2.0
+		pass
+	return gpd.GeoSeries(simplified, index=geometry.index, crs=geometry.crs)
+
+def shapes_for(gdf, width, height):
+	""" 'gdf' (as returned by load_shapes) with the coarsest geometry whose tolerance is below one pixel
+	of a plot of 'width' x 'height' pixels showing all of it, and without the other geometries """
+	minx, miny, maxx, maxy = gdf.total_bounds
+	pixel = max((maxx - minx) / width, (maxy - miny) / height)
+	columns = [c for c in gdf.columns if not c.startswith('geometry_')]
+	levels = [i for i, tolerance in enumerate(SIMPLIFY_TOLERANCES) if tolerance <= pixel and 'geometry_%i'%i in gdf.columns]
+	shapes = gdf[columns].copy()
+	if levels:
+		shapes['geometry'] = gdf['geometry_%i'%levels[-1]]
+	return shapes
+
+def json_value(value):
+	""" Property value for GeoJSON: plain Python types, and None instead of NaN """
+	if isinstance(value, np.generic):
+		value = value.item()
+	if isinstance(value, float) and np.isnan(value):
+		return None
+	return value
+
+def coordinates_json(coordinates, fmt):
+	""" Nested coordinates of a geometry as a JSON string, with the numbers written with 'fmt' """
+	if len(coordinates) > 0 and isinstance(coordinates[0], (int, float)):
+		return '[%s]'%','.join(fmt%c for c in coordinates)
+	return '[%s]'%','.join(coordinates_json(c, fmt) for c in coordinates)
+
+def geojson(gdf, properties, precision=COORD_PRECISION):
+	""" GeoJSON FeatureCollection (a string) of 'gdf' for a GeoJSONDataSource, written in a single pass.
+	Only the columns in 'properties' are included, and the coordinates are written with 'precision' decimals """
+	fmt = '%%.%if'%precision
+	features = []
+	for geometry, values in zip(gdf.geometry, gdf[properties].itertuples(index=False, name=None)):
+		if geometry is None or geometry.is_empty:
+			geometry_json = 'null'
+		else:
+			mapping = shapely.geometry.mapping(geometry)
+			geometry_json = '{"type":"%s","coordinates":%s}'%(mapping['type'], coordinates_json(mapping['coordinates'], fmt))
+		properties_json = json.dumps({k: json_value(v) for k, v in zip(properties, values)}, separators=(',', ':'))
+		features.append('{"type":"Feature","properties":%s,"geometry":%s}'%(properties_json, geometry_json))
+	return '{"type":"FeatureCollection","features":[%s]}'%','.join(features)
+
+def clean_colombia(gdf):
+	""" Departments of Colombia, with their names normalized for matching """
 	gdf = gdf[['cartodb_id', 'departamen', 'geometry']]
 
 	# Remove 'None' values
-	gdf = gdf[~gdf['geometry'].isnull()]
+	gdf = gdf[~gdf['geometry'].isnull()].copy()
 
 	# Rename columns
 	gdf.columns = ['cartodb_id', 'departamento', 'geometry']
@@ -59,14 +195,45 @@ def colombia_map(variable='confirmed', logscale=False):
 	# Make columns with lowered and 'normalized' values
 	gdf['departamento_normalized'] = gdf['departamento'].str.lower().str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8').str.replace(' ', '').str.replace('.', '')
 
-	# Lower the strings in 'departamento'
+	# Change cartodb_id to int so that it can be merged with the data
+	gdf.cartodb_id = gdf.cartodb_id.astype(int)
+	return gdf
+
+def clean_world(gdf):
+	""" Countries of the world, without Antarctica """
+	gdf = gdf[['ADMIN', 'ADM0_A3', 'geometry']]
+
+	# Rename columns
+	gdf.columns = ['country', 'country_code', 'geometry']
+
+	# Drop row corresponding to 'Antarctica'
+	return gdf.drop(gdf.index[159])
+
+def colombia_shapes():
+	""" Departments of Colombia (see load_shapes) """
+	shapefile = os.path.join(ws.folders['data/misc'], 'departamentos_colombia/departamentos_colombia.shp')
+	return load_shapes('departamentos_colombia', shapefile, clean_colombia)
+
+def world_shapes():
+	""" Countries of the world (see load_shapes) """
+	shapefile = os.path.join(ws.folders['data/misc'], 'countries/ne_110m_admin_0_countries.shp')
+	return load_shapes('ne_110m_admin_0_countries', shapefile, clean_world)
+
+def colombia_map(variable='confirmed', logscale=False):
+	"""
+	Interactive Colombian map in bokeh figure
+	"""
+
+	# Size of the plot
+	width, height = 400, 500
+
+	gdf = shapes_for(colombia_shapes(), width, height)
 
 	# Point to the Colombian COVID-19 dataframe
 	df = ws.data_specific['Colombia']['last_date']
 
 	# Change cartodb_id to int so that the dataframes can be merged
 	df.cartodb_id = df.cartodb_id.astype(int)
-	gdf.cartodb_id = gdf.cartodb_id.astype(int)
 
 	# For merging, leave only the relevant columns
 	df = df[['cartodb_id', 'iso', 'departamento_correcto', 'confirmed']]
@@ -74,14 +241,8 @@ def colombia_map(variable='confirmed', logscale=False):
 	# Merge the dataframes
 	merged = gdf.merge(df, left_on='cartodb_id', right_on='cartodb_id', how='left')
 	
-	# Read data to json
-	merged_json = json.loads(merged.to_json())
-
-	# Convert to String like object.
-	json_data = json.dumps(merged_json)
-
-	# Input GeoJSON source that contains features for plotting.
-	geosource = GeoJSONDataSource(geojson=json_data)
+	# Input GeoJSON source that contains features for plotting, with only the columns used by the map
+	geosource = GeoJSONDataSource(geojson=geojson(merged, ['cartodb_id', 'iso', 'departamento_correcto', variable]))
 	
 	# Define a sequential multi-hue color palette.
 	order = int(np.log10(df[variable].max()))
@@ -154,8 +315,8 @@ def colombia_map(variable='confirmed', logscale=False):
 	# Create figure object.
 	p = figure(
 			title = 'Casos confirmados en Colombia, %s'%last_date, 
-			plot_height = 500, 
-			plot_width = 400, 
+			plot_height = height, 
+			plot_width = width, 
 			# aspect_ratio="auto", 
 			# aspect_scale=1, 
 			toolbar_location = None, 
@@ -195,27 +356,21 @@ def colombia_map(variable='confirmed', logscale=False):
 
 	# Save file
 	if logscale:
-		output_file(os.path.join(ws.folders["website/static/images"], "colombia_map_log.html"))
+		path = os.path.join(ws.folders["website/static/images"], "colombia_map_log.html")
 	else:
-		output_file(os.path.join(ws.folders["website/static/images"], "colombia_map.html"))
+		path = os.path.join(ws.folders["website/static/images"], "colombia_map.html")
 	# show(p)
-	save(p)
+	export.save_figure(p, path)
 
 def world_map(variable='confirmed', logscale=False):
 	"""
 	Interactive world map in bokeh figure
 	"""
 
-	shapefile = os.path.join(ws.folders['data/misc'], 'countries/ne_110m_admin_0_countries.shp')
-
-	# Read shapefile using Geopandas
-	gdf = gpd.read_file(shapefile)[['ADMIN', 'ADM0_A3', 'geometry']]
-
-	# Rename columns
-	gdf.columns = ['country', 'country_code', 'geometry']
+	# Size of the plot
+	width, height = 800, 500
 
-	# Drop row corresponding to 'Antarctica'
-	gdf = gdf.drop(gdf.index[159])
+	gdf = shapes_for(world_shapes(), width, height)
 
 	# Folder containing daily reports
 	folder = os.path.join(ws.folders['data/covid'], 'csse_covid_19_data/csse_covid_19_daily_reports/')
@@ -227,15 +382,8 @@ def world_map(variable='confirmed', logscale=False):
 	df_last_date = df[df['date_key'] == ws.dates_keys[-1]][['country_region', variable]]
 	merged = gdf.merge(df_last_date, left_on='country', right_on='country_region', how='left')
 	
-	# Read data to json
-	merged_json = json.loads(merged.to_json())
-
-	# Convert to String like object.
-	json_data = json.dumps(merged_json)
-
-
-	# Input GeoJSON source that contains features for plotting.
-	geosource = GeoJSONDataSource(geojson=json_data)
+	# Input GeoJSON source that contains features for plotting, with only the columns used by the map
+	geosource = GeoJSONDataSource(geojson=geojson(merged, ['country', 'country_code', variable]))
 
 	
 	# Define a sequential multi-hue color palette.
@@ -263,7 +411,7 @@ def world_map(variable='confirmed', logscale=False):
 	tick_labels_log = dict([('%i'%i, '%i'%i) for i in np.logspace(0, order, order + 1)])
 
 	# Add hover tool
-	hover = HoverTool(tooltips=[('País', '@country'), ('Casos', '@active')])
+	hover = HoverTool(tooltips=[('País', '@country'), ('Casos', '@%s'%variable)])
 
 	#Create color bar. 
 	color_bar = ColorBar(
@@ -290,8 +438,8 @@ def world_map(variable='confirmed', logscale=False):
 	# Create figure object.
 	p = figure(
 			title = 'Casos reportados como activos en el mundo, %s'%ws.dates_keys[-1], 
-			plot_height = 500, 
-			plot_width = 800, 
+			plot_height = height, 
+			plot_width = width, 
 			toolbar_location = None, 
 			# tools = [hover]
 		)
@@ -321,8 +469,122 @@ def world_map(variable='confirmed', logscale=False):
 
 	# Save file
 	if logscale:
-		output_file(os.path.join(ws.folders["website/static/images"], "world_map_log.html"))
+		path = os.path.join(ws.folders["website/static/images"], "world_map_log.html")
 	else:
-		output_file(os.path.join(ws.folders["website/static/images"], "world_map.html"))
+		path = os.path.join(ws.folders["website/static/images"], "world_map.html")
 	# show(p)
-	save(p)
\ No newline at end of file
+	export.save_figure(p, path)
+
+def world_map_animated(start, end, variable='active', logscale=True):
+	"""
+	Interactive world map with a slider (and a play button) to go through the dates from 'start' to 'end' (see tools.get_start_end).
+	The geometry is sent once; the values of all the dates go in a single country x date array that the slider indexes,
+	so the size of the figure grows with the number of countries and dates, not with the geometry
+	"""
+
+	# Size of the plot
+	width, height = 800, 500
+
+	gdf = shapes_for(world_shapes(), width, height)
+
+	# Values of every country of the map (rows) on every date (columns). Countries without data are NaN
+	start_index, end_index = tls.get_start_end(start, end)
+	countries = gdf['country'].tolist()
+	matrix = cube.get_matrix(countries, variable, start_index, end_index).astype(np.float32)
+	matrix[[c not in ws.cube_country_indices for c in countries]] = np.nan
+	dates = cube.get_dates(start_index, end_index)
+	ndates = len(dates)
+
+	# The map starts on the last date
+	shapes = gdf[['country', 'country_code', 'geometry']].copy()
+	shapes[variable] = matrix[:, -1]
+	geosource = GeoJSONDataSource(geojson=geojson(shapes, ['country', 'country_code', variable]))
+	values = ColumnDataSource(data={'values': matrix.ravel()})
+
+	# Define a sequential multi-hue color palette, the same for all the dates
+	max_value = np.nanmax(matrix) if np.any(matrix > 0) else 1
+	order = int(np.log10(max_value))
+	max_rounded = utl.round_up_order(max_value, order)
+	nlinticks = int(max_rounded // (10 ** order) + 1)
+	if logscale:
+		palette = brewer['Reds'][min(max(order + 1, 3), 9)][::-1]
+		color_mapper = LogColorMapper(palette=palette, low=1, high=10**(order+1))
+		ticker = LogTicker()
+	else:
+		palette = brewer['Reds'][min(max(nlinticks - 1, 3), 9)][::-1]
+		color_mapper = LinearColorMapper(palette=palette, low=0, high=max_rounded)
+		ticker = FixedTicker(ticks=[int(v) for v in np.linspace(0, max_rounded, nlinticks)])
+
+	# Add hover tool
+	hover = HoverTool(tooltips=[('País', '@country'), ('Casos', '@%s'%variable)])
+
+	#Create color bar. 
+	color_bar = ColorBar(
+			color_mapper=color_mapper, 
+			label_standoff=8, 
+			width = 450, 
+			height = 10,
+			border_line_color=None, 
+			location = (0,0), 
+			orientation = 'horizontal', 
+			ticker=ticker, 
+		)
+
+	# Create figure object.
+	title = 'Casos %s en el mundo, '%ws.trans.get(variable, variable)
+	p = figure(
+			title = title + ws.dates_keys[end_index], 
+			plot_height = height, 
+			plot_width = width, 
+			toolbar_location = None, 
+		)
+	p.add_tools(hover)
+
+	p.xgrid.grid_line_color = None
+	p.ygrid.grid_line_color = None
+
+	# Add patch renderer to figure. 
+	p.patches(
+			'xs', 
+			'ys', 
+			source = geosource, 
+			fill_color = {'field' :variable, 'transform' : color_mapper}, 
+			line_color = 'black', 
+			line_width = 0.25, 
+			fill_alpha = 1
+		)
+	p.add_layout(color_bar, 'below')
+
+	# Slider and play button
+	slider = DateSlider(
+			title = 'Fecha', 
+			start = dates[0].item(), 
+			end = dates[-1].item(), 
+			value = dates[-1].item(), 
+			step = 1, 
+			format = '%d/%m/%Y', 
+			width = width - 100, 
+		)
+	slider.js_on_change('value', CustomJS(
+			args=dict(
+				slider=slider, 
+				values=values, 
+				geosource=geosource, 
+				p=p, 
+				variable=variable, 
+				title=title, 
+				start=int(dates[0].astype('datetime64[ms]').astype(np.int64)), 
+				ndates=ndates, 
+				ncountries=len(countries), 
+			), 
+			code=SLIDER_JS, 
+		))
+	button = Button(label='\u25B6', width=60)
+	button.js_on_click(CustomJS(args=dict(button=button, slider=slider, interval=FRAME_INTERVAL), code=PLAY_JS))
+
+	# Save file
+	if logscale:
+		path = os.path.join(ws.folders["website/static/images"], "world_map_animated_log.html")
+	else:
+		path = os.path.join(ws.folders["website/static/images"], "world_map_animated.html")
+	export.save_figure(column(p, row(button, slider)), path)
@@ -0,0 +1,134 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+metrics.py:
+Epidemiological metrics (growth rate, doubling time, acceleration and Rt) for many regions at once.
+All the functions take 2D arrays of cumulative cases (regions x dates) and work along the last axis
+"""
+import math
+import time
+import numpy as np
+
+import workspace as ws
+import windows
+
+
+# Serial interval of COVID-19 (days), used for Rt. Values from Nishiura et al. (2020)
+SERIAL_INTERVAL_MEAN = 4.7
+SERIAL_INTERVAL_SD = 2.9
+# Longest serial interval considered (days)
+SERIAL_INTERVAL_MAX = 20
+# Gamma prior of Rt (shape and scale), as in Cori et al. (2013)
+RT_PRIOR_SHAPE = 1.
+RT_PRIOR_SCALE = 5.
+
+
+
+def lagged(x, lag):
+	""" 'x' shifted 'lag' days forward along the last axis. The first 'lag' days are NaN """
+	out = np.full(x.shape, np.nan)
+	if lag < x.shape[-1]:
+		out[..., lag:] = x[..., :x.shape[-1] - lag]
+	return out
+
+def growth_rate(confirmed, window=7):
+	""" Average daily growth rate of the cumulative cases over the last 'window' days.
+	NaN when there were no cases at the start of the window """
+	confirmed = np.asarray(confirmed, dtype=float)
+	before = lagged(confirmed, window)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		rate = np.where(before > 0, (confirmed / before) ** (1. / window) - 1., np.nan)
+	return rate
+
+def doubling_time(confirmed, window=7):
+	""" Days it would take the cumulative cases to double at the current growth rate.
+	NaN (rather than infinite) when they are not growing """
+	rate = growth_rate(confirmed, window)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.where(rate > 0, math.log(2.) / np.log1p(rate), np.nan)
+
+def acceleration(confirmed, window=7):
+	""" Daily change of the new cases averaged over 'window' days """
+	smoothed = windows.rolling_mean(windows.new_cases(np.asarray(confirmed, dtype=float)), window)
+	return windows.new_cases(smoothed)
+
+def serial_interval(mean=SERIAL_INTERVAL_MEAN, sd=SERIAL_INTERVAL_SD, smax=SERIAL_INTERVAL_MAX):
+	""" Discretized gamma distribution of the serial interval for days 1 to 'smax' (w[0] is day 1) """
+	shape = (mean / sd) ** 2
+	scale = sd ** 2 / mean
+	days = np.arange(1, smax + 1) - 0.5
+	logpdf = (shape - 1.) * np.log(days) - days / scale - math.lgamma(shape) - shape * math.log(scale)
+	w = np.exp(logpdf)
+	return w / w.sum()
+
+def infectiousness(incidence, w):
+	""" Total infectiousness of the cases before each day: sum over s of incidence[t - s] * w[s - 1] """
+	out = np.zeros(incidence.shape)
+	n = incidence.shape[-1]
+	for s, weight in enumerate(w, start=1):
+		if s >= n:
+			break
+		out[..., s:] += weight * incidence[..., :n - s]
+	return out
+
+def rt(confirmed, window=7, mean=SERIAL_INTERVAL_MEAN, sd=SERIAL_INTERVAL_SD, prior_shape=RT_PRIOR_SHAPE, prior_scale=RT_PRIOR_SCALE):
+	""" Mean of the posterior of the reproduction number over a sliding window of 'window' days (Cori et al., 2013).
+	Negative new cases (corrections in the data) count as zero. NaN where there is no infectiousness yet """
+	incidence = np.clip(windows.new_cases(np.asarray(confirmed, dtype=float)), 0, None)
+	pressure = infectiousness(incidence, serial_interval(mean, sd))
+	pressure = windows.rolling_sum(pressure, window)
+	shape = prior_shape + windows.rolling_sum(incidence, window)
+	rate = 1. / prior_scale + pressure
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.where(pressure > 0, shape / rate, np.nan)
+
+def compute_all(confirmed, window=7):
+	""" All the metrics for a 2D array of cumulative cases """
+	return {
+		'growth_rate': growth_rate(confirmed, window),
+		'doubling_time': doubling_time(confirmed, window),
+		'acceleration': acceleration(confirmed, window),
+		'rt': rt(confirmed, window),
+	}
+
+def frame_matrix(df, key, dates, variable='confirmed'):
+	""" Turn a long dataframe (one row per 'key' and date) into labels, dates and a 2D array [key, date] """
+	pivot = df.pivot_table(index=key, columns=dates, values=variable, aggfunc='sum', fill_value=0).sort_index(axis=1)
+	return pivot.index.tolist(), pivot.columns.tolist(), pivot.to_numpy()
+
+def compute_metrics(window=7):
+	""" Compute the metrics for all the countries (from the cube) and all the Colombian departments.
+	Save them in ws.metrics, with their labels and dates """
+	t0 = time.time()
+	ws.metrics = {}
+
+	confirmed = ws.cube[:, ws.cube_variable_indices['confirmed'], :]
+	ws.metrics['countries'] = compute_all(confirmed, window)
+	ws.metrics['countries']['labels'] = ws.cube_countries
+	ws.metrics['countries']['dates'] = ws.dates_array
+
+	try:
+		df = ws.data_specific['Colombia']['time_series']
+	except (AttributeError, KeyError):
+		pass
+	else:
+		labels, dates, confirmed = frame_matrix(df, 'departamento', 'fecha_obj')
+		ws.metrics['colombia'] = compute_all(confirmed, window)
+		ws.metrics['colombia']['labels'] = labels
+		ws.metrics['colombia']['dates'] = np.array(dates, dtype='datetime64[D]')
+
+	print('\tEpidemiological metrics computed in %.2f s'%(time.time() - t0))
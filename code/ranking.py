@@ -0,0 +1,133 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+ranking.py:
+Rank countries or regions by a metric taken from one date, instead of sorting their whole history.
+The metrics are:
+	'total': the value of the variable on the date (for cumulative variables, this is their maximum)
+	'new': its increase over the last 'ndays' days
+	'max': its maximum over the whole history (the only one whose cost grows with the history)
+"""
+import weakref
+import numpy as np
+
+import workspace as ws
+import windows
+
+
+# Rankings already computed: {key: (weak reference to the data they come from, labels)}
+rankings = {}
+
+
+
+def largest(values, n):
+	""" Indices of the 'n' largest 'values', from largest to smallest.
+	Only the top 'n' are sorted (partial selection). NaN values go last """
+	values = np.where(np.isnan(values), -np.inf, values.astype(float))
+	n = min(n, len(values))
+	if n <= 0:
+		return np.array([], dtype=np.int64)
+	if n < len(values):
+		top = np.argpartition(-values, n - 1)[:n]
+	else:
+		top = np.arange(len(values))
+	return top[np.argsort(-values[top], kind='mergesort')]
+
+def apply_population(labels, values, population):
+	""" Values per 100000 inhabitants. 'population' is a dictionary {label: population}.
+	Labels without population get NaN, so they are ranked last """
+	pop = np.array([population.get(label, np.nan) for label in labels], dtype=float)
+	return windows.per_capita(values, pop)
+
+def last_reported(series, date_index):
+	""" Value of each row of 'series' [country, date] on its last date with data (not zero) up to 'date_index'.
+	The cube holds zeros on the dates a country is missing from the reports, so it would drop out of the ranking otherwise """
+	positions = np.where(series[:, :date_index + 1] != 0, np.arange(date_index + 1), 0)
+	last = np.maximum.accumulate(positions, axis=1)[:, -1]
+	return series[np.arange(series.shape[0]), last]
+
+def cube_values(variable, metric='total', ndays=7, date_index=-1):
+	""" Labels and values of the metric for all the countries in the cube, on the date in 'date_index' """
+	series = ws.cube[:, ws.cube_variable_indices[variable], :]
+	date_index = date_index % series.shape[1]
+	if metric == 'total':
+		values = last_reported(series, date_index)
+	elif metric == 'new':
+		values = last_reported(series, date_index) - last_reported(series, max(date_index - ndays, 0))
+	elif metric == 'max':
+		values = series.max(axis=1)
+	else:
+		raise ValueError('Unknown metric: %s'%metric)
+	return ws.cube_countries, values
+
+def frame_values(df, key, variable, dates, metric='total', ndays=7):
+	""" Labels and values of the metric for each 'key' of a long dataframe (one row per key and date), on its last date with data """
+	if metric == 'max':
+		grouped = df.groupby(key, sort=False)[variable].max()
+		return grouped.index.tolist(), grouped.to_numpy()
+	# Value of each key on each date; a key missing from the last dates keeps its last value
+	per_date = df.groupby([key, dates])[variable].sum(min_count=1)
+	all_dates = np.sort(df[dates].unique())
+	last = per_date.groupby(level=0).last()
+	if metric == 'total':
+		values = last
+	elif metric == 'new':
+		cutoff = all_dates[max(len(all_dates) - 1 - ndays, 0)]
+		before = per_date[per_date.index.get_level_values(1) <= cutoff].groupby(level=0).last()
+		values = last.sub(before, fill_value=0)
+	else:
+		raise ValueError('Unknown metric: %s'%metric)
+	return values.index.tolist(), values.to_numpy()
+
+def cached(key, source, compute):
+	""" Ranking for 'key', computed with 'compute()' unless it is stored and comes from the same 'source' """
+	try:
+		ref, labels = rankings[key]
+	except KeyError:
+		pass
+	else:
+		if ref() is source:
+			return labels
+	labels = compute()
+	rankings[key] = (weakref.ref(source), labels)
+	return labels
+
+def top_n(n=10, variable='confirmed', metric='total', ndays=7, population=None):
+	""" Top 'n' countries by 'metric' of 'variable' on the last date.
+	If 'population' ({country: population}) is given, the ranking is per capita """
+	def compute():
+		labels, values = cube_values(variable, metric=metric, ndays=ndays)
+		if population is not None:
+			values = apply_population(labels, values, population)
+		return [labels[i] for i in largest(values, n)]
+	key = ('countries', variable, metric, ndays, population is not None, n)
+	if population is not None:
+		return compute()
+	return cached(key, ws.data_countries_only, compute)
+
+def top_n_frame(df, n=10, key='country_region', variable='confirmed', dates='date', metric='total', ndays=7, population=None):
+	""" Top 'n' values of 'key' in a long dataframe by 'metric' of 'variable' on its last date.
+	If 'population' ({key: population}) is given, the ranking is per capita """
+	def compute():
+		labels, values = frame_values(df, key, variable, dates, metric=metric, ndays=ndays)
+		if population is not None:
+			values = apply_population(labels, values, population)
+		return [labels[i] for i in largest(values, n)]
+	cache_key = (key, variable, metric, ndays, population is not None, n)
+	if population is not None:
+		return compute()
+	return cached(cache_key, df, compute)
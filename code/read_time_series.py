@@ -24,18 +24,26 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import utils as utl
 import workspace as ws
+import cache
+import cube
 
 
+# Version of the processing of the daily reports (parsing included). Change it to invalidate the cached results
+INGEST_VERSION = 3
 
-def read_time_series_01():
-	""" This is a test data analysis that will be improved later on """
+# Columns of the daily reports with the number of cases
+COUNT_COLUMNS = ['confirmed', 'deaths', 'recovered', 'active', 'closed']
 
-	# Folder where the time series are stored
-	folder = '../data/csse_covid_19_data/csse_covid_19_time_series/'
 
+def read_time_series_01(folder='../data/csse_covid_19_data/csse_covid_19_time_series/'):
+	""" Read the wide time series of CSSE (one column per date) into a long dataframe, with one row per location and date """
+
+	# Folder where the time series are stored
 	files = [os.path.join(folder, item) for item in os.listdir(folder) if '.csv' in item]
 	# List of time series
 
@@ -48,15 +56,13 @@ def read_time_series_01():
 		dr_name = dr.split('/')[-1]
 		# Name of the variable (confirmed, deaths or recovered)
 		varname = dr_name.split('.')[0].split('-')[-1].lower()
-		with open(dr, 'r') as f:
-			dataframe = pd.read_csv(dr)
-			# dataframe.set_index('Country/Region', inplace=True)
-			data[varname] = dataframe
+		dataframe = pd.read_csv(dr)
+		# dataframe.set_index('Country/Region', inplace=True)
+		data[varname] = dataframe
 
 	# Find the date key list
 	data_columns = dataframe.columns
 	dates = OrderedDict()
-	date_indices = OrderedDict()
 	previous_keys = []
 	for col_name in data_columns:
 		try:
@@ -67,134 +73,239 @@ def read_time_series_01():
 			date_key = date.strftime('%d/%m/%Y')
 			dates[date_key] = date
 			previous_keys.append(col_name)
-			date_indices[date_key] = len(dates) - 1
 	# Number of dates
 	ndates = len(dates)
 
-	# Store dates in ws
-	ws.dates = dates
-
-	# Dictionary with the provinces for each country
-	provinces = OrderedDict()
+	# Number of locations (rows in the files)
 	nlocations = dataframe.shape[0]
-	for i in range(nlocations):
-		dfi = dataframe.loc[i]
-		try:
-			provinces[dfi['Country/Region']].append(dfi['Province/State'])
-		except KeyError:
-			provinces[dfi['Country/Region']] = [dfi['Province/State']]
-
 
 	# Create new dataset that rearranges the data
+	# Each location is repeated once per date, and the dates are tiled once per location
+	# The values are stacked row by row, so they follow the same order
 	columns = ['Country/Region', 'Province/State', 'Lat', 'Long', 'Date Key', 'Date Value', 'confirmed', 'deaths', 'recovered']
-	ds_new = pd.DataFrame(index=np.arange(nlocations * ndates), columns=columns)
-
-	# Set up the ds_new from the information in the last dataframe
-	# j = 0
-	end = -1
-	for i in range(nlocations):
-		dfi = dataframe.loc[i]
-		start = end + 1
-		end = start - 1 + ndates
-		ds_new.loc[start:end, 'Country/Region'] = dfi['Country/Region']
-		ds_new.loc[start:end, 'Province/State'] = dfi['Province/State']
-		ds_new.loc[start:end, 'Lat'] = dfi['Lat']
-		ds_new.loc[start:end, 'Long'] = dfi['Long']
-		ds_new.loc[start:end, 'Date Key'] = list(dates.keys())
-		ds_new.loc[start:end, 'Date Value'] = list(dates.values())
-		for variable in ['confirmed', 'recovered', 'deaths']:
-			ds_new.loc[start:end, variable] = data[variable].loc[i][previous_keys].tolist()
-
-	# Show the time series for the whole world
-	ws.dates_keys = list(dates.keys())
-	ws.date_indices = date_indices
-	ws.dates = dates
+	ds_new = pd.DataFrame(OrderedDict([
+			('Country/Region', np.repeat(dataframe['Country/Region'].to_numpy(), ndates)), 
+			('Province/State', np.repeat(dataframe['Province/State'].to_numpy(), ndates)), 
+			('Lat', np.repeat(dataframe['Lat'].to_numpy(), ndates)), 
+			('Long', np.repeat(dataframe['Long'].to_numpy(), ndates)), 
+			('Date Key', np.tile(np.array(list(dates.keys()), dtype=object), nlocations)), 
+			('Date Value', np.tile(np.array(list(dates.values()), dtype=object), nlocations)), 
+		]), columns=columns)
+	for variable in ['confirmed', 'recovered', 'deaths']:
+		ds_new[variable] = data[variable][previous_keys].to_numpy().ravel()
+
+	# Date index
+	set_dates(list(dates.values()))
 
 	# Save the dataframe in the workspace
 	ws.data = ds_new
 
-def read_daily_reports_JHU_CSSE():
-	""" Read daily reports from John Hopkins University's GitHub repo """	
-
-	# Folder where the time series are stored
-	folder = os.path.join(ws.folders['data/covid'], 'csse_covid_19_data/csse_covid_19_daily_reports/')
-
-	files = sorted([os.path.join(folder, item) for item in os.listdir(folder) if '.csv' in item])
-
-	# # Columns that the datasets will have
-	# columns = []
-
-	# Dictionary for the data
+def set_dates(dates):
+	""" Set up the date index in the workspace from a sorted list of date objects.
+	ws.dates_array holds them as datetime64[D], and the position of each date in it is its ordinal.
+	The date keys ('%d/%m/%Y') are only meant for presentation """
+	ws.dates_array = np.array(dates, dtype='datetime64[D]')
+	ws.dates_keys = [date.strftime('%d/%m/%Y') for date in dates]
+	ws.dates = OrderedDict(zip(ws.dates_keys, dates))
+	ws.date_indices = OrderedDict((date_key, i) for i, date_key in enumerate(ws.dates_keys))
+
+def report_date(dr):
+	""" Date of a daily report, from its file name """
+	return datetime.strptime(dr.split('/')[-1].split('.')[0], '%m-%d-%Y').date()
+
+def parse_daily_report(dr):
+	""" Read a single daily report, stamp it with its date and homogenize its column names """
+	dataframe = pd.read_csv(dr)
+	# Add date
+	date = report_date(dr)
+	date_key = date.strftime('%d/%m/%Y')
+	dataframe['date'] = date
+	dataframe['date_key'] = date_key
+
+	# Rename columns
+	dataframe.rename(columns=
+			{
+				'Province/State': 'province_state', 
+				'Country/Region': 'country_region', 
+				'Last Update': 'last_update', 
+				'Lat': 'latitude', 
+				'Long_': 'longitude'
+			}, 
+			inplace=True
+		)
+	# Lower case all the column names
+	dataframe.rename(columns=dict([(s, s.lower()) for s in dataframe.columns]), inplace=True)
+
+	# Keep track of the file it comes from
+	dataframe['report'] = os.path.basename(dr)
+
+	return dataframe
+
+def parse_daily_reports(files, workers=1):
+	""" Parse a list of daily reports, fanning them out to a pool of 'workers' processes if it is greater than 1.
+	The results are returned in the same order as 'files'. If the pool cannot be used, the files are parsed serially """
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = min(workers, len(files))
+	if workers > 1:
+		try:
+			with ProcessPoolExecutor(max_workers=workers) as executor:
+				return list(executor.map(parse_daily_report, files, chunksize=max(1, len(files) // (4 * workers))))
+		except (OSError, BrokenProcessPool) as e:
+			print('\tParallel parsing of the daily reports failed (%s); parsing them serially'%e)
+	return [parse_daily_report(dr) for dr in files]
+
+def read_raw_daily_reports(files, incremental=True, workers=1):
+	""" Concatenate the parsed daily reports in 'files' (sorted by date), keeping that order.
+	If 'incremental', only the reports that are new or changed since the last run are parsed;
+	the rest are taken from the frame stored in the cache, unless it was stored with another INGEST_VERSION.
+	'workers' is the number of processes used for parsing (see parse_daily_reports) """
+
+	manifest_name = 'daily_reports_manifest.json'
+	frame_name = 'daily_reports_raw.pkl'
+
+	# Previous state. It is discarded if the reports were parsed by another version of the code
+	state = cache.load_manifest(manifest_name) if incremental else {}
+	manifest = state.get('files', {}) if state.get('version') == INGEST_VERSION else {}
+	stored = cache.load_frame(frame_name) if manifest else None
+	if stored is None:
+		manifest = {}
+
+	# Find out what needs to be parsed
+	new_manifest, changed = cache.changed_files(files, manifest)
+
+	# Start from the stored frame, leaving out the reports that changed or disappeared
 	data = OrderedDict()
-
-	# Dictionaries for the dates
-	dates = OrderedDict()
-	date_indices = OrderedDict()
-
-	# New data with re-arranged information
-
-	for dr in files:
-		# Get the date from the file name
-		date_str = dr.split('/')[-1].split('.')[0]
-		# print(date_str, dr)
-		# Name of the variable (confirmed, deaths or recovered)
-		with open(dr, 'r') as f:
-			dataframe = pd.read_csv(dr)
-			# Add date
-			date = datetime.strptime(date_str, '%m-%d-%Y').date()
-			date_key = date.strftime('%d/%m/%Y')
-			dataframe['date'] = date
-			dataframe['date_key'] = date_key
-
-			# Rename columns
-			dataframe.rename(columns=
-					{
-						'Province/State': 'province_state', 
-						'Country/Region': 'country_region', 
-						'Last Update': 'last_update', 
-						'Lat': 'latitude', 
-						'Long_': 'longitude'
-					}, 
-					inplace=True
-				)
-			# Lower case all the column names
-			dataframe.rename(columns=dict([(s, s.lower()) for s in dataframe.columns]), inplace=True)
-
-			# Save dataframe in dictionary
-			data[date_str] = dataframe
-
-			# Save date
-			dates[date_key] = date
-			date_indices[date_key] = len(dates) - 1
+	if stored is not None:
+		keep = set(new_manifest.keys()) - set(os.path.basename(dr) for dr in changed)
+		data['stored'] = stored[stored['report'].isin(keep)]
+
+	# Parse only what changed
+	for dr, dataframe in zip(changed, parse_daily_reports(changed, workers=workers)):
+		data[dr] = dataframe
+
+	# Merge
+	ds_raw = pd.concat(data, ignore_index=True)
+	# Keep the same row order as if all files had been read in sequence
+	order = {os.path.basename(dr): i for i, dr in enumerate(files)}
+	ds_raw = ds_raw.iloc[np.argsort(ds_raw['report'].map(order).to_numpy(), kind='mergesort')].reset_index(drop=True)
+
+	# Save the new state
+	if changed or set(manifest.keys()) != set(new_manifest.keys()):
+		cache.save_frame(ds_raw, frame_name)
+		cache.save_manifest({'version': INGEST_VERSION, 'files': new_manifest}, manifest_name)
+
+	return ds_raw
+
+def aliases_file():
+	""" Path to the table of aliases of country names """
+	return os.path.join(ws.folders['data/misc'], 'config/country_aliases.csv')
+
+def load_country_aliases():
+	""" Read the table of aliases of country names as a dictionary {alias: name} """
+	with open(aliases_file(), 'r', newline='') as f:
+		return {row['alias']: row['country'] for row in csv.DictReader(f)}
+
+def apply_aliases(series, aliases):
+	""" Replace the aliases in 'series' by their names in a single pass.
+	Each distinct value is looked up only once """
+	codes, uniques = pd.factorize(series)
+	renamed = np.array([aliases.get(u, u) for u in uniques] + [np.nan], dtype=object)
+	# NaN values have code -1, which picks the last element
+	return pd.Series(renamed[codes], index=series.index, name=series.name)
+
+def unmapped_countries(series):
+	""" Sorted list of the country names in 'series' that do not appear in the world map shapefile """
+	shapefile_table = os.path.join(ws.folders['data/misc'], 'countries/ne_110m_admin_0_countries.dbf')
+	known = set(utl.read_dbf_column(shapefile_table, 'ADMIN'))
+	return sorted(set(series.dropna()) - known)
+
+def optimize_dtypes(df):
+	""" Convert the columns of a daily reports dataframe to compact data types:
+	categories for the labels, datetime64 for the dates, the narrowest integers for the counts
+	and float32 for the rest of numbers. Missing counts become 0, which is how they count in any sum """
+	df = df.copy()
+	for column in df.columns:
+		series = df[column]
+		if column == 'date':
+			df[column] = pd.to_datetime(series)
+		elif column in COUNT_COLUMNS:
+			df[column] = pd.to_numeric(series.fillna(0).astype(np.int64), downcast='integer')
+		elif series.dtype == object:
+			df[column] = series.astype('category')
+		elif series.dtype.kind == 'f':
+			df[column] = series.astype(np.float32)
+	return df
+
+def process_daily_reports(ds_raw):
+	""" Clean the concatenated daily reports and aggregate them by country.
+	Return the clean dataframe and the dataframe with countries only """
 
 	# Concatenate all the dataframes
-	ds_new = pd.concat(data, ignore_index=True).sort_values(by=['country_region', 'province_state'], ignore_index=True)
+	ds_new = ds_raw.drop(columns='report').sort_values(by=['country_region', 'province_state'], ignore_index=True)
 
 	# Clean the data
 
 	# Rename certain countries to avoid duplicity
-	ds_new.replace('Mainland China', 'China', inplace=True)
-	ds_new.replace('US', 'United States of America', inplace=True)
-	ds_new.replace('UK', 'United Kingdom', inplace=True)
-	ds_new.replace('Korea, South', 'South Korea', inplace=True)
-	ds_new.replace('Republic of Korea', 'South Korea', inplace=True)
-	ds_new.replace('Iran (Islamic Republic of)', 'Iran', inplace=True)
-	ds_new.replace('Hong Kong SAR', 'Hong Kong', inplace=True)
-	ds_new.replace('Macao SAR', 'Macao', inplace=True)
-	ds_new.replace(' Azerbaijan', 'Azerbaijan', inplace=True)
+	aliases = load_country_aliases()
+	for column in ['country_region', 'province_state']:
+		ds_new[column] = apply_aliases(ds_new[column], aliases)
+
+	# Report the countries that will not be found in the world map
+	ws.unmapped_countries = unmapped_countries(ds_new['country_region'])
+	if ws.unmapped_countries:
+		print('\tCountry names not found in the world map (add them to %s if they are aliases):'%os.path.basename(aliases_file()))
+		print('\t\t' + '; '.join(ws.unmapped_countries))
 
 	# Update 'active' column
 	ds_new['closed'] = ds_new['recovered'] + ds_new['deaths']
 	ds_new['active'] = ds_new['confirmed'] - ds_new['closed']
 
+	# Use compact data types
+	memory_before = ds_new.memory_usage(deep=True).sum()
+	ds_new = optimize_dtypes(ds_new)
+	memory_after = ds_new.memory_usage(deep=True).sum()
+	ws.memory_report = {'before': memory_before, 'after': memory_after}
+	print('\tDaily reports in memory: %.1f MB (%.1f MB saved)'%(memory_after / 2**20, (memory_before - memory_after) / 2**20))
+
 	# New dataframe containing countries only (i.e., excluding provinces)
-	ds_countries = ds_new.groupby(['country_region', 'date', 'date_key']).sum().reset_index()
+	# Some versions of pandas do not sort categorical groups when observed=True, so sort them explicitly
+	ds_countries = ds_new.groupby(['country_region', 'date', 'date_key'], observed=True).sum(numeric_only=True).reset_index()
+	ds_countries = ds_countries.sort_values(by=['country_region', 'date'], ignore_index=True)
+	ds_countries = optimize_dtypes(ds_countries)
+
+	return ds_new, ds_countries
+
+def read_daily_reports_JHU_CSSE(incremental=True, use_cache=True, workers=1):
+	""" Read daily reports from John Hopkins University's GitHub repo.
+	If 'use_cache', the processed dataframes are loaded from the cache when the reports did not change.
+	'workers' is the number of processes used to parse the reports (None for one per CPU) """	
+
+	# Folder where the time series are stored
+	folder = os.path.join(ws.folders['data/covid'], 'csse_covid_19_data/csse_covid_19_daily_reports/')
 
-	# Show the time series for the whole world
-	ws.dates_keys = list(dates.keys())
-	ws.date_indices = date_indices
-	ws.dates = dates
+	# Files sorted by date (their names are not, across years)
+	files = [os.path.join(folder, item) for item in os.listdir(folder) if '.csv' in item]
+	files = sorted(files, key=report_date)
+
+	# If none of the reports changed since the last run, load the processed data directly
+	fingerprint = cache.files_fingerprint(files + [aliases_file()], version=INGEST_VERSION)
+	stored = cache.load_frames(['daily_reports', 'daily_reports_countries'], fingerprint) if use_cache else None
+	if stored is not None:
+		ds_new, ds_countries = stored
+		ws.unmapped_countries = unmapped_countries(ds_countries['country_region'])
+	else:
+		# Read the reports, parsing only the ones that are new
+		ds_raw = read_raw_daily_reports(files, incremental=incremental, workers=workers)
+		ds_new, ds_countries = process_daily_reports(ds_raw)
+		cache.save_frames({'daily_reports': ds_new, 'daily_reports_countries': ds_countries}, fingerprint)
+
+	# Date index
+	set_dates([report_date(dr) for dr in files])
 
 	# Save the dataframe in the workspace
 	ws.data = ds_new
 	ws.data_countries_only = ds_countries
+
+	# Dense arrays with the time series of every country
+	cube.build_cube()
@@ -0,0 +1,139 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+render.py:
+Render the figures of the web site, each one as an independent job, in a pool of processes.
+The workers are forked, so they see the data already prepared in the workspace (and the series cache) without copying it.
+What they add to the series cache is not shared, so the series used by several figures should be cached before rendering
+"""
+import os
+import time
+import shutil
+import tempfile
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import workspace as ws
+import cache
+import series_cache
+import downsample
+
+
+
+def job(name, function, *args, **kwargs):
+	""" Describe a figure job: 'function' will be called with 'args' and 'kwargs'.
+	'function' must be defined at module level, so that it can be sent to the workers """
+	return {'name': name, 'function': function, 'args': args, 'kwargs': kwargs}
+
+def publish(path, target):
+	""" Move the file in 'path' to 'target', atomically, unless 'target' has the same contents already.
+	Return True if 'target' was replaced """
+	if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(path) and cache.file_hash(target) == cache.file_hash(path):
+		os.remove(path)
+		return False
+	os.replace(path, target)
+	return True
+
+@contextlib.contextmanager
+def staging(published):
+	""" Make the figures write into a temporary folder inside the images folder, and publish their files when they finish.
+	The names of the files that changed are appended to 'published'. If the figure fails, nothing is published """
+	images = ws.folders['website/static/images']
+	folder = tempfile.mkdtemp(prefix='.staging_', dir=images)
+	ws.folders['website/static/images'] = folder
+	try:
+		yield
+		for name in sorted(os.listdir(folder)):
+			if publish(os.path.join(folder, name), os.path.join(images, name)):
+				published.append(name)
+	finally:
+		ws.folders['website/static/images'] = images
+		shutil.rmtree(folder, ignore_errors=True)
+
+def run_job(job):
+	""" Run a figure job and return its timing, its error (a traceback, or None), the files it changed and the use of the series cache.
+	Jobs that declare their 'outputs' are staged (see staging), so their files are only replaced when they change """
+	stats_before = series_cache.series.stats()
+	published = []
+	# Whether the layout of the figure must be written (see export.save_split)
+	ws.write_layout = job.get('layout', True)
+	# Points allowed in the figure (None for all of them; see export.save_split)
+	ws.point_budget = job.get('point_budget', downsample.POINT_BUDGET)
+	t0 = time.time()
+	try:
+		if job.get('outputs') is not None:
+			with staging(published):
+				job['function'](*job['args'], **job['kwargs'])
+		else:
+			job['function'](*job['args'], **job['kwargs'])
+	except Exception:
+		error = traceback.format_exc()
+	else:
+		error = None
+	stats_after = series_cache.series.stats()
+	return {
+		'name': job['name'],
+		'time': time.time() - t0,
+		'error': error,
+		'published': published,
+		'cache': {k: stats_after[k] - stats_before[k] for k in ['hits', 'misses']},
+	}
+
+def fork_context():
+	""" Multiprocessing context that forks the workers, or None if forking is not available """
+	try:
+		return multiprocessing.get_context('fork')
+	except ValueError:
+		return None
+
+def render(jobs, workers=1):
+	""" Run all the figure jobs, in a pool of 'workers' processes if it is greater than 1 (None for one per CPU).
+	A job that fails does not stop the others. Return the results of the jobs (see run_job), in the same order.
+	If the pool cannot be used (no fork, or it breaks), the remaining jobs run serially """
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = min(workers, len(jobs))
+	results = {}
+	context = fork_context()
+	if workers > 1 and context is not None:
+		try:
+			with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+				futures = {executor.submit(run_job, j): i for i, j in enumerate(jobs)}
+				for future in as_completed(futures):
+					results[futures[future]] = future.result()
+		except (OSError, BrokenProcessPool) as e:
+			print('\tParallel rendering failed (%s); rendering the remaining figures serially'%e)
+	for i, j in enumerate(jobs):
+		if i not in results:
+			results[i] = run_job(j)
+	return [results[i] for i in range(len(jobs))]
+
+def report(results):
+	""" Print the timing of each figure, the errors and the totals """
+	for r in results:
+		status = 'ERROR' if r['error'] is not None else 'ok (%i files changed)'%len(r['published'])
+		print('\t\t%-40s %7.2f s  %s'%(r['name'], r['time'], status))
+	for r in results:
+		if r['error'] is not None:
+			print('\tFigure %s failed:\n%s'%(r['name'], r['error']))
+	hits = sum(r['cache']['hits'] for r in results)
+	misses = sum(r['cache']['misses'] for r in results)
+	failed = sum(r['error'] is not None for r in results)
+	print('\t%i figures rendered (%i failed) in %.2f s of work; series cache: %i hits, %i misses'%(len(results) - failed, failed, sum(r['time'] for r in results), hits, misses))
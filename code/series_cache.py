@@ -0,0 +1,107 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+series_cache.py:
+In-memory cache of the time series computed while making the graphs, so that none is computed twice in a run.
+The keys are (country, variable, start_index, end_index, window); the least recently used entries are evicted first
+"""
+import weakref
+from collections import OrderedDict
+
+import workspace as ws
+
+
+# Maximum number of series kept in memory
+MAXSIZE = 2048
+
+
+
+class LRUCache():
+	""" Dictionary with a maximum size that evicts its least recently used entries.
+	It counts its hits and misses, and it empties itself when ws.data_countries_only is replaced """
+
+	def __init__(self, maxsize=MAXSIZE):
+		self.maxsize = maxsize
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.source = None
+
+	def check_source(self):
+		""" Empty the cache if the data it was computed from is not ws.data_countries_only anymore """
+		current = getattr(ws, 'data_countries_only', None)
+		source = self.source() if self.source is not None else None
+		if source is None or source is not current:
+			self.entries.clear()
+			self.source = weakref.ref(current) if current is not None else None
+
+	def get(self, key, compute):
+		""" Value for 'key'. If it is not in the cache, it is obtained by calling 'compute()' and stored """
+		self.check_source()
+		try:
+			value = self.entries[key]
+		except KeyError:
+			self.misses += 1
+			value = compute()
+			self.put(key, value)
+		else:
+			self.hits += 1
+			self.entries.move_to_end(key)
+		return value
+
+	def lookup(self, key):
+		""" Value for 'key', or None if it is not in the cache """
+		self.check_source()
+		try:
+			value = self.entries[key]
+		except KeyError:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.entries.move_to_end(key)
+		return value
+
+	def put(self, key, value):
+		""" Store 'value' for 'key', evicting the least recently used entries if the cache is full """
+		self.entries[key] = value
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+			self.evictions += 1
+
+	def clear(self):
+		""" Empty the cache and reset its counters """
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.source = None
+
+	def stats(self):
+		""" Counters of the cache """
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'size': len(self.entries),
+			'maxsize': self.maxsize,
+		}
+
+
+# Cache shared by all the graphs
+series = LRUCache()
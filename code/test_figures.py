@@ -0,0 +1,66 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+test_figures.py:
+Check that the fingerprints of the dependencies of the figures can be computed from a workspace built like in a real run.
+Run with pytest from the 'code' folder
+"""
+import os
+import datetime
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('geopandas')
+pytest.importorskip('bokeh')
+pytest.importorskip('matplotlib')
+
+import workspace as ws
+import read_time_series as rts
+import cube
+import figures
+
+
+
+@pytest.fixture
+def workspace(tmp_path):
+	""" Small workspace: three countries over five dates, the cube built from them and Colombian frames """
+	pardir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	ws.folders = {'data/misc': os.path.join(pardir, 'data_misc'), 'data/cache': str(tmp_path)}
+
+	dates = [datetime.date(2020, 3, 1) + datetime.timedelta(days=i) for i in range(5)]
+	rts.set_dates(dates)
+	rows = []
+	for c, country in enumerate(['Colombia', 'Spain', 'Italy']):
+		for d, date in enumerate(dates):
+			rows.append({'country_region': country, 'date': pd.Timestamp(date), 'confirmed': 10 * c + d, 'deaths': d, 'recovered': 0, 'active': 10 * c, 'closed': d})
+	ws.data_countries_only = pd.DataFrame(rows)
+	cube.build_cube()
+
+	frame = pd.DataFrame({'iso': ['ANT', 'BOG'], 'confirmed': [3, 5]})
+	ws.data_specific = {'Colombia': {'last_date': frame, 'time_series': frame}}
+	return ws
+
+def test_dependency_fingerprints(workspace):
+	fingerprints = figures.dependency_fingerprints()
+	assert set(fingerprints.keys()) == {'jhu', 'colombia', 'world_shapefile', 'colombia_shapefile'}
+	assert all(isinstance(v, str) and len(v) == 40 for v in fingerprints.values())
+
+def test_dependency_fingerprints_follow_the_dates(workspace):
+	before = figures.dependency_fingerprints()['jhu']
+	ws.dates_array = ws.dates_array + np.timedelta64(1, 'D')
+	assert figures.dependency_fingerprints()['jhu'] != before
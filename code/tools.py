@@ -19,19 +19,25 @@ import os
 import json
 import itertools
 import numpy as np
+from collections import OrderedDict
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
 from bokeh.plotting import figure, save
-from bokeh.models import Slider, HoverTool, Range1d, NumeralTickFormatter, DatetimeTickFormatter, GeoJSONDataSource, LinearColorMapper, LogColorMapper, ColorBar, BasicTicker, LogTicker
+from bokeh.models import ColumnDataSource, Slider, HoverTool, Range1d, NumeralTickFormatter, DatetimeTickFormatter, GeoJSONDataSource, LinearColorMapper, LogColorMapper, ColorBar, BasicTicker, LogTicker
 from bokeh.io import show, output_file, curdoc
 from bokeh.palettes import brewer, Category20, Category10
 from bokeh.layouts import widgetbox, row, column
 
 import workspace as ws
 import utils as utl
+import export
+import cube
+import windows
+import series_cache
+import ranking
 
 
 plt.style.use('format001.mplstyle')
@@ -43,10 +49,12 @@ def cases_per_day(x):
 	return x[1:] - x[:-1]
 
 def get_start_end(start, end):
-	""" Get the numerical indices for 'start' and 'end' """
-	start_index = ws.date_indices[start]
-	end_index = ws.date_indices[end]
-	return start_index, end_index
+	""" Get the numerical indices for 'start' and 'end'.
+	They can be date keys ('%d/%m/%Y'), date objects or datetime64, and they do not need to be in the data:
+	'start' goes to the first date on or after it and 'end' to the last date on or before it """
+	start_index = np.searchsorted(ws.dates_array, utl.to_datetime64(start), side='left')
+	end_index = np.searchsorted(ws.dates_array, utl.to_datetime64(end), side='right') - 1
+	return int(start_index), int(end_index)
 
 def get_country_date(country, date):
 	""" Get the data for a country and a date """
@@ -56,28 +64,21 @@ def get_country_date(country, date):
 		data[variable] = df[df['country_region'] == country][df['Date'] == date][variable].sum()
 	return data
 
-def get_single_time_series(df, variable, start_index, end_index):
-	""" Get the time series for 'variable' in 'df', from 'start_index' to 'end_index'.
+def get_single_time_series(country, variable, start_index, end_index):
+	""" Get the time series for 'variable' in 'country' (or the whole world), from 'start_index' to 'end_index'.
 	Return the dates and values (data) as numpy arrays """
-	dates_ = []
-	data = []
-	for date in ws.dates_keys[start_index:end_index + 1]:
-		data.append(df[df['date_key'] == date][variable].sum())
-		dates_.append(ws.dates[date])
-	return np.array(dates_), np.array(data)
+	key = (country, variable, start_index, end_index, None)
+	return series_cache.series.get(key, lambda: (cube.get_dates(start_index, end_index), cube.get_series(country, variable, start_index, end_index)))
 
 def time_series_bokeh(start, end, country='world'):
 		""" Show the time series of the world in a HTML graph """
 
 		# Get data
-		df = ws.data_countries_only
-		if country != 'world':
-			df = df[df['country_region'] == country]
 		start_index, end_index = get_start_end(start, end)
 		data = {}
 		variables = ['confirmed', 'recovered', 'deaths']
 		for variable in variables:
-			data['dates'], data[variable] = get_single_time_series(df, variable, start_index, end_index)
+			data['dates'], data[variable] = get_single_time_series(country, variable, start_index, end_index)
 
 		# Existing cases
 		data['resolved'] = data['recovered'] + data['deaths']
@@ -143,15 +144,69 @@ def time_series_bokeh(start, end, country='world'):
 		p.toolbar.logo = None
 
 		# Output to static HTML file
-		output_file(os.path.join(ws.folders["website/static/images"], "%s_graph.html"%country.lower()))
+		path = os.path.join(ws.folders["website/static/images"], "%s_graph.html"%country.lower())
 		# show(p)
-		save(p)
+		export.save_figure(p, path)
+
+def pack_countries(data, x, y, colors):
+		""" Pack the data of many countries ({country: {column: values}}) into two sources:
+		one line per country (for multi_line) and one row per point (for a single scatter), both with a 'country' column """
+		countries = list(data.keys())
+		lines = ColumnDataSource({
+			'xs': [np.asarray(d[x]) for d in data.values()], 
+			'ys': [np.asarray(d[y]) for d in data.values()], 
+			'country': countries, 
+			'color': list(colors), 
+		})
+		# Columns that all the countries have, flattened, in the order of the first country (so the output is the same in every run)
+		datasets = list(data.values())
+		columns = [c for c in datasets[0].keys() if all(c in d for d in datasets[1:])] if datasets else []
+		points = {}
+		for column in columns:
+			values = [d[column] for d in data.values()]
+			if all(isinstance(v, np.ndarray) for v in values):
+				points[column] = np.concatenate(values)
+			else:
+				points[column] = list(itertools.chain.from_iterable(values))
+		points['color'] = list(itertools.chain.from_iterable(len(d[y]) * [c] for d, c in zip(data.values(), colors)))
+		points['country'] = list(itertools.chain.from_iterable(len(d[y]) * [country] for country, d in data.items()))
+		return lines, ColumnDataSource(points)
+
+def plot_countries(p, data, x, y, colors, alpha=1., legend=False, size=5):
+		""" Draw many countries with two renderers: a multi_line and a scatter sharing the 'country' column.
+		Hovering over a line highlights it. Return the scatter renderer, for the hover tool with the values """
+		lines, points = pack_countries(data, x, y, colors)
+		legend_kwargs = {'legend_field': 'country'} if legend else {}
+		renderer_lines = p.multi_line(
+				'xs', 
+				'ys', 
+				source=lines, 
+				line_color='color', 
+				line_width=2, 
+				line_alpha=alpha, 
+				hover_line_color='color', 
+				hover_line_alpha=1., 
+				hover_line_width=4, 
+				**legend_kwargs
+			)
+		renderer_points = p.circle(x, y, source=points, color='color', size=size, alpha=alpha)
+		# Highlight the line under the mouse
+		p.add_tools(HoverTool(renderers=[renderer_lines], tooltips=[('País', '@country')], show_arrow=False, line_policy='nearest'))
+		return renderer_points
+
+def label_last_points(p, data, x, y, **kwargs):
+		""" Write the name of each country next to its last point, with a single text renderer """
+		countries = list(data.keys())
+		last = ColumnDataSource({
+			'x': [d[x][-1] for d in data.values()], 
+			'y': [d[y][-1] for d in data.values()], 
+			'country': countries, 
+		})
+		return p.text('x', 'y', text='country', source=last, **kwargs), last
 
 def compare_countries(start, end, variable='confirmed', countries=None, label='', title_add=''):
 		""" Show the time series of the world in a HTML graph """
 			
-		# Get data
-		df = ws.data_countries_only
 		# Date range
 		start_index, end_index = get_start_end(start, end)
 
@@ -194,26 +249,18 @@ def compare_countries(start, end, variable='confirmed', countries=None, label=''
 		else:
 			colors = category10[:]
 
-		# Iterate over countries
-		for i, country in enumerate(countries):
-
-			# Get data for the country
-			df_ = df[df['country_region'] == country]
-			data = {}
-			data['date_obj'], data[variable] = get_single_time_series(df_, variable, start_index, end_index)
-			# data['date_key'] = [x.strftime("%d/%m/%Y") for x in data['date_obj']]
-			data['date_key'] = ws.dates_keys[start_index:end_index + 1]
-			data['country'] = len(data[variable]) * [country]
-
-			# Plot data
-			if not many_countries:
-				p.circle('date_obj', variable, source=data, color=colors[i], size=5, alpha=alpha, legend_label=country)
-				p.line('date_obj', variable, source=data, color=colors[i], line_width=2, alpha=alpha, legend_label=country)
-			else:
-				p.circle('date_obj', variable, source=data, color=colors[i], size=5, alpha=alpha)
-				p.line('date_obj', variable, source=data, color=colors[i], line_width=2, alpha=alpha)
-				# p.text(x=data['date_obj'], y=data[variable], text=[country],text_baseline="middle", text_align="left")
-				p.text(x=data['date_obj'][-1], y=data[variable][-1], text=[country])
+		# Get data for all the countries
+		data = OrderedDict()
+		for country in countries:
+			data[country] = {}
+			data[country]['date_obj'], data[country][variable] = get_single_time_series(country, variable, start_index, end_index)
+			data[country]['date_key'] = ws.dates_keys[start_index:end_index + 1]
+
+		# Plot data: all the countries share two renderers
+		points = plot_countries(p, data, 'date_obj', variable, colors[:ncountries], alpha=alpha, legend=legend)
+		hover.renderers = [points]
+		if add_text:
+			label_last_points(p, data, 'date_obj', variable)
 
 		# Arrange figure
 		p.xaxis.axis_label = 'Fecha'
@@ -225,32 +272,21 @@ def compare_countries(start, end, variable='confirmed', countries=None, label=''
 		p.toolbar.logo = None
 
 		# Output to static HTML file
-		output_file(os.path.join(ws.folders["website/static/images"], "%s_%s_time_series.html"%(label, variable)))
+		path = os.path.join(ws.folders["website/static/images"], "%s_%s_time_series.html"%(label, variable))
 		# show(p)
-		save(p)
+		export.save_figure(p, path)
 
-def get_new_7_days(start_index, end_index, variable, country='world', avg=False):
-		""" Get the new cases in the last 7 days for a country """
+def get_new_7_days_batch(start_index, end_index, countries=None, avg=False, ndays=7):
+		""" Get the new cases in the last 7 days (or 'ndays') for a list of countries (all of them if None), in one go.
+		Return a dictionary with the list of countries, the dates, and 2D arrays [country, date] for
+		'confirmed', 'active', 'new' and 'new_7_days'. If 'avg', the latter is averaged with integer division """
 
-		# Get data for countries
-		df = ws.data_countries_only
-		# Choose country from the dataset
-		if country != 'world':
-			df = df[df['country_region'] == country]
-
-		# Target size for the arrays to return
-		target_size = end_index - start_index + 1
-
-		# Number of days
-		ndays = 7
-		# Choose if the output is an average
-		if avg:
-			avg_div = ndays
-		else:
-			avg_div = 1
+		if countries is None:
+			countries = ws.cube_countries
+		countries = list(countries)
 
 		# Data to return
-		data = {}
+		data = {'countries': countries}
 
 		# Get confirmed and active cases
 		# The time series need to span the whole time (or, at least, 7 days before start_index)
@@ -262,39 +298,63 @@ def get_new_7_days(start_index, end_index, variable, country='world', avg=False)
 		indshift = start_index - start_index_
 		# Get time series
 		for variable in ['confirmed', 'active']:
-			dates_, data[variable] = get_single_time_series(df, variable, start_index_, end_index)
-
-		# Format dates to strings
-		data['date'] = []
-		data['date_obj'] = []
-		for date in dates_:
-			date_str = date.strftime('%d/%m/%Y')
-			data['date'].append(date_str)
-			data['date_obj'].append(ws.dates[date_str])
-
-		# To array
-		data['date_obj'] = np.array(data['date_obj'])
-
-		c = data['confirmed']
-		new = np.zeros_like(data['confirmed'])
-		data['new_7_days'] = np.zeros_like(c)
-		new[1:] = c[1:] - c[:-1]
-		data['new'] = new
-
-		new7days = np.zeros_like(new)
-		for i in range(ndays - 1):
-			new7days[i] += new[:i+1].sum()
-		for i in range(ndays - 1, len(new), 1):
-			new7days[i] += new[i-(ndays-1):i+1].sum()
-		data['new_7_days'] = new7days // avg_div
-
-		data['country'] = len(data[variable]) * [country]
+			data[variable] = cube.get_matrix(countries, variable, start_index_, end_index)
+
+		# New cases, and their sum (or average) over the window
+		data['new'] = windows.new_cases(data['confirmed'])
+		if avg:
+			data['new_%i_days'%ndays] = windows.rolling_mean(data['new'], ndays, integer=True)
+		else:
+			data['new_%i_days'%ndays] = windows.rolling_sum(data['new'], ndays)
 
 		# Now chop the elements in data from indshift
-		data = {k: v[indshift:] for k, v in data.items()}
+		data = {k: v[:, indshift:] if k != 'countries' else v for k, v in data.items()}
+
+		# Dates, and their keys for the hover tools
+		data['date'] = ws.dates_keys[start_index:end_index + 1]
+		data['date_obj'] = cube.get_dates(start_index, end_index)
 
 		return data
 
+def split_batch(batch):
+		""" Split the output of get_new_7_days_batch into one dictionary per country, ready to be plotted """
+		data = OrderedDict()
+		for i, country in enumerate(batch['countries']):
+			data[country] = {
+				k: v[i] for k, v in batch.items() if isinstance(v, np.ndarray) and v.ndim == 2
+			}
+			data[country]['date'] = batch['date']
+			data[country]['date_obj'] = batch['date_obj']
+			data[country]['country'] = len(batch['date']) * [country]
+		return data
+
+def get_new_7_days_many(start_index, end_index, countries=None, avg=False, ndays=7):
+		""" Like split_batch(get_new_7_days_batch(...)), but going through the series cache:
+		only the countries that are not cached yet are computed, all of them at once """
+		if countries is None:
+			countries = ws.cube_countries
+		variable = 'new_%i_days_avg'%ndays if avg else 'new_%i_days'%ndays
+		keys = {country: (country, variable, start_index, end_index, ndays) for country in countries}
+
+		# Look up the cache
+		data = OrderedDict((country, series_cache.series.lookup(key)) for country, key in keys.items())
+
+		# Compute what is missing
+		missing = [country for country, d in data.items() if d is None]
+		if missing:
+			batch = split_batch(get_new_7_days_batch(start_index, end_index, countries=missing, avg=avg, ndays=ndays))
+			for country, d in batch.items():
+				series_cache.series.put(keys[country], d)
+				data[country] = d
+
+		# Shallow copies, so that the callers can add columns without altering the cache
+		return OrderedDict((country, dict(d)) for country, d in data.items())
+
+def get_new_7_days(start_index, end_index, variable, country='world', avg=False, ndays=7):
+		""" Get the new cases in the last 7 days (or 'ndays') for a country.
+		If 'avg', they are averaged with integer division """
+		return get_new_7_days_many(start_index, end_index, countries=[country], avg=avg, ndays=ndays)[country]
+
 def new_vs_active(start, end, x_range=None, y_range=None, variable='active', country='world', use_top_n=False, log=False):
 	""" Show graph of new cases vs. active """
 
@@ -341,10 +401,10 @@ def new_vs_active(start, end, x_range=None, y_range=None, variable='active', cou
 	p.toolbar.logo = None
 
 	# Output to static HTML file
-	output_file(os.path.join(ws.folders["website/static/images"], "new_vs_%s_last7days_%s.html"%(variable, country.lower())))
+	path = os.path.join(ws.folders["website/static/images"], "new_vs_%s_last7days_%s.html"%(variable, country.lower()))
 
 	# show(p)
-	save(p)
+	export.save_figure(p, path)
 
 	######################################
 	# Bokeh figure for all the countries
@@ -380,22 +440,17 @@ def new_vs_active(start, end, x_range=None, y_range=None, variable='active', cou
 		if y_range is not None:
 			p.y_range = Range1d(*y_range)
 
-		df = ws.data_countries_only
-		countries = set(df.country_region)
+		countries = ws.cube_countries
 		if use_top_n:
 			countries = ws.top_ten
-		for country in countries:
-
-			data = get_new_7_days(start_index, end_index, variable, country=country, avg=True)
-			
-			# Add a circle renderer with a size, color and alpha
-			p.circle(variable, 'new_7_days', source=data, size=5, color="black", alpha=0.2)
-			p.line(variable, 'new_7_days', source=data, line_width=2, color="black", alpha=0.2)
-			# Last circle indicating the country
-			data_last = {k: [v[-1]] for k, v in data.items()}
-			data_last['country'] = [country]
-			p.circle(variable, 'new_7_days', source=data_last, size=10, color="magenta", alpha=1.)
-			p.text(x=data_last[variable], y=data_last['new_7_days'], text=[country],text_baseline="middle", text_align="left")
+		# Data for all the countries, computed at once
+		batch = get_new_7_days_many(start_index, end_index, countries=countries, avg=True)
+		# All the countries share two renderers
+		points = plot_countries(p, batch, variable, 'new_7_days', len(batch) * ['black'], alpha=0.2)
+		# Last circle indicating each country
+		_, last = label_last_points(p, batch, variable, 'new_7_days', text_baseline="middle", text_align="left")
+		p.circle('x', 'y', source=last, size=10, color="magenta", alpha=1.)
+		hover2.renderers = [points]
 
 		# Arrange figure
 		p.xaxis.axis_label = 'Casos %s'%ws.trans[variable]
@@ -409,19 +464,17 @@ def new_vs_active(start, end, x_range=None, y_range=None, variable='active', cou
 		# Output to static HTML file
 		use_log_str = 'logscale' if log else ''
 		if use_top_n:
-			output_file(os.path.join(ws.folders["website/static/images"], "new_vs_%s_last7days_top_n%01i_%s.html"%(variable, ws.ntop, use_log_str)))
+			path = os.path.join(ws.folders["website/static/images"], "new_vs_%s_last7days_top_n%01i_%s.html"%(variable, ws.ntop, use_log_str))
 		else:
-			output_file(os.path.join(ws.folders["website/static/images"], "	new_vs_%s_last7days_whole_world_%s.html"%(variable, use_log_str)))
+			path = os.path.join(ws.folders["website/static/images"], "	new_vs_%s_last7days_whole_world_%s.html"%(variable, use_log_str))
 
 		# show(p)
-		save(p)
+		export.save_figure(p, path)
 
-def top_n(df, n=10, groupby=['country_region']):
-	""" Find top n countries/regions by confirmed cases.
-	Spans the whole COVID-19 period """
-
-	top_n = df.sort_values(by='confirmed', ignore_index=True, ascending=False).groupby(groupby, sort=False)['confirmed'].max().index[:n]
-	return top_n.tolist()
+def top_n(df, n=10, groupby=['country_region'], dates='date', variable='confirmed'):
+	""" Find top n countries/regions by confirmed cases (or 'variable').
+	They are ranked by their value on the last date, which is their maximum for cumulative variables """
+	return ranking.top_n_frame(df, n=n, key=groupby[0], variable=variable, dates=dates)
 
 def new_time_series(start, end, y_range=None, country='world', variable='new', use_top_n=False, log=False):
 	""" Show the time series of new cases.
@@ -484,11 +537,11 @@ def new_time_series(start, end, y_range=None, country='world', variable='new', u
 	p.yaxis.formatter = NumeralTickFormatter(format="0")
 	p.toolbar.logo = None
 
-	# Output to static HTML file
-	output_file(os.path.join(ws.folders["website/static/images"], "%s_vs_date_%s.html"%(variable, country.lower())))
+	# Output to static HTML file (each scale in its own file)
+	path = os.path.join(ws.folders["website/static/images"], "%s_vs_date_%s%s.html"%(variable, country.lower(), '_logscale' if log else ''))
 
 	# show(p)
-	save(p)
+	export.save_figure(p, path)
 
 	######################################
 	# Bokeh figure for all the countries
@@ -521,17 +574,16 @@ def new_time_series(start, end, y_range=None, country='world', variable='new', u
 		if y_range is not None:
 			p.y_range = Range1d(*y_range)
 
-		df = ws.data_countries_only
-		countries = set(df.country_region)
+		countries = ws.cube_countries
 		if use_top_n:
 			countries = ws.top_ten
-		for i, country in enumerate(countries):
-
-			data = get_new_7_days(start_index, end_index, variable, country=country, avg=True)
-			
-			# Add a circle renderer with a size, color and alpha
-			p.circle('date_obj', variable, source=data, color=Category10[10][i], size=5, alpha=1., legend_label=country)
-			p.line('date_obj', variable, source=data, color=Category10[10][i], line_width=2, alpha=1., legend_label=country)
+		# Data for all the countries, computed at once
+		batch = get_new_7_days_many(start_index, end_index, countries=countries, avg=True)
+		# All the countries share two renderers. Beyond 10 countries, they are drawn in black and without legend
+		few = len(batch) <= 10
+		colors = Category10[10][:len(batch)] if few else len(batch) * ['black']
+		points = plot_countries(p, batch, 'date_obj', variable, colors, alpha=1. if few else 0.2, legend=few)
+		hover2.renderers = [points]
 
 		# Arrange figure
 		# p.x_range = Range1d(data['date_obj'][0], data['date_obj'][-1])
@@ -539,29 +591,44 @@ def new_time_series(start, end, y_range=None, country='world', variable='new', u
 		p.yaxis.axis_label = 'Casos nuevos %s'%variable_str[variable]
 		p.xaxis.formatter = DatetimeTickFormatter(days="%d %B")
 		p.yaxis.formatter = NumeralTickFormatter(format="0")
-		p.legend.location = 'top_left'
+		if few:
+			p.legend.location = 'top_left'
 		p.toolbar.logo = None
 
 		# Output to static HTML file
 		use_log_str = 'logscale' if log else ''
 		if use_top_n:
-			output_file(os.path.join(ws.folders["website/static/images"], "%s_vs_date_top_n%01i_%s.html"%(variable, ws.ntop, use_log_str)))
+			path = os.path.join(ws.folders["website/static/images"], "%s_vs_date_top_n%01i_%s.html"%(variable, ws.ntop, use_log_str))
 		else:
-			output_file(os.path.join(ws.folders["website/static/images"], "	%s_vs_date_whole_world_%s.html"%(variable_str[variable], use_log_str)))
+			path = os.path.join(ws.folders["website/static/images"], "	%s_vs_date_whole_world_%s.html"%(variable_str[variable], use_log_str))
 
 		# show(p)
-		save(p)
+		export.save_figure(p, path)
+
+def countries_dayn(n, countries=None):
+	""" Show countries (all of them if None) from the day they reached or surpassed n cases """
 
-def countries_dayn(n, countries):
-	""" Show countries from the day they reached or surpassed n cases """
+	# Label of the countries for the file names
+	label = 'all' if countries is None else ''.join([c[0] for c in countries])
 
-	# Get data
-	df = ws.data_countries_only
+	# Whole time series of all the countries, aligned to the day each one reached n cases
+	countries, day0, confirmed = cube.days_since(n, countries)
 
 	# Parameters
 	linewidths = {k: 1 for k in countries}
 	linewidths['Colombia'] = 2
-	end = '01/04/2020'
+	# New cases in 7 days (average), computed before aligning so that the first days use the previous week
+	ndates = len(ws.dates_array)
+	new_7_days = windows.rolling_mean(windows.new_cases(cube.get_matrix(countries, 'confirmed', 0, ndates - 1)), 7, integer=True)
+	data = {
+		'confirmed': confirmed, 
+		'new_7_days': cube.align(new_7_days, day0), 
+	}
+
+	# Days
+	days = np.arange(data['confirmed'].shape[1])
+	daysmin = 0
+	daysmax = max(len(days) - 1, 1)
 
 	# Create figures
 	fig1, ax1 = plt.subplots()
@@ -569,73 +636,46 @@ def countries_dayn(n, countries):
 	fig3, ax3 = plt.subplots()
 
 	# Iterate over countries to plot data
-	for country in countries:
-
-		# Find the day when n cases were reached for each country
-		# First, get the whole time series
-		dates_, x = get_single_time_series(df[df['country_region'] == country], 'confirmed', 0, ws.date_indices['01/04/2020'])
-		# Find where the country reached the n cases
-		date_index = np.where(x >= n)[0][0]
-		start = ws.dates_keys[date_index]
-		start_index, end_index = get_start_end(start, end)
-
-		data = {}
-
-		daysmin = 1e99
-		daysmax = -1e99
-
-		dates_, x = get_single_time_series(df[df['country_region'] == country], 'confirmed', start_index, end_index)
-		data['confirmed'] = x[:]
-
-		# Get new cases in 7 days
-		data_n7d = get_new_7_days(start_index, end_index, 'confirmed', country=country, avg=True)
+	for i, country in enumerate(countries):
 
-		# Days
-		days = np.arange(len(dates_))
-		daysmin = min(days.min(), daysmin)
-		daysmax = max(days.max(), daysmax)
+		# Skip the countries that never reached n cases
+		if day0[i] >= ndates:
+			continue
 
 		# CASOS CONFIRMADOS
-		ax1.plot(days, data['confirmed'], 'o-', lw=linewidths[country], label=country)
+		ax1.plot(days, data['confirmed'][i], 'o-', lw=linewidths[country], label=country)
 
 		# VELOCIDAD
-		c = data['confirmed']
-		velocidad = c[1:] - c[:-1]
-		velocidad = data_n7d['new_7_days']
-		# ax2.plot(days[1:], velocidad, 'o-', lw=linewidths[country], label=country)
+		velocidad = data['new_7_days'][i]
 		ax2.plot(days, velocidad, 'o-', lw=linewidths[country], label=country)
 
 		# ACELERACIÓN
 		aceleracion = velocidad[1:] - velocidad[:-1]
-		# ax3.plot(days[2:], aceleracion, 'o-', lw=linewidths[country], label=country)
 		ax3.plot(days[1:], aceleracion, 'o-', lw=linewidths[country], label=country)
 
 	# Arrange figures
 	# 1
-	ax1.set_ylim(0, 1100)
 	# ax1.set_yscale('log')
-	utl.configure_axes(ax1, xlims=(daysmin, 14), xlabel='Días después de alcanzar %i casos'%n, ylabel='Casos confirmados')
+	utl.configure_axes(ax1, xlims=(daysmin, daysmax), xlabel='Días después de alcanzar %i casos'%n, ylabel='Casos confirmados')
 	ax1.set_title('Casos confirmados')
 	# 2
 	# ax2.set_ylim(0, 500)
-	ax2.set_ylim(0, 250)
 	# ax2.set_yscale('log')
-	utl.configure_axes(ax2, xlims=(daysmin, 14), xlabel='Días después de alcanzar %i casos'%n, ylabel='Velocidad (casos confirmados nuevos diarios)')
-	utl.configure_axes(ax2, xlims=(daysmin, 14), xlabel='Días después de alcanzar %i casos'%n, ylabel='Velocidad (casos confirmados nuevos diarios;\npromedio de 7 días)')
+	utl.configure_axes(ax2, xlims=(daysmin, daysmax), xlabel='Días después de alcanzar %i casos'%n, ylabel='Velocidad (casos confirmados nuevos diarios)')
+	utl.configure_axes(ax2, xlims=(daysmin, daysmax), xlabel='Días después de alcanzar %i casos'%n, ylabel='Velocidad (casos confirmados nuevos diarios;\npromedio de 7 días)')
 	ax2.set_title('Velocidad')
 	# 3
 	# ax3.set_ylim(-10, 100)
-	ax3.set_ylim(-10, 50)
 	# ax3.set_yscale('log')
 	ax3.axhline(y=0, ls='--', c='grey')
-	utl.configure_axes(ax3, xlims=(daysmin, 14), xlabel='Días después de alcanzar %i casos'%n, ylabel='Aceleración (aumento diario de casos confirmados nuevos)')
-	utl.configure_axes(ax3, xlims=(daysmin, 14), xlabel='Días después de alcanzar %i casos'%n, ylabel='Aceleración (aumento diario de casos confirmados nuevos;\npromedio de 7 días)')
+	utl.configure_axes(ax3, xlims=(daysmin, daysmax), xlabel='Días después de alcanzar %i casos'%n, ylabel='Aceleración (aumento diario de casos confirmados nuevos)')
+	utl.configure_axes(ax3, xlims=(daysmin, daysmax), xlabel='Días después de alcanzar %i casos'%n, ylabel='Aceleración (aumento diario de casos confirmados nuevos;\npromedio de 7 días)')
 	ax3.set_title('Aceleración')
 
 	# Save figures
-	fig1.savefig(os.path.join(ws.folders['website/static/images'], 'custom_casos_%i_%s_v2.png'%(n, ''.join([c[0] for c in countries]))), bbox_inches='tight', dpi=300)
-	fig2.savefig(os.path.join(ws.folders['website/static/images'], 'custom_velocidad_%i_%s_v4.png'%(n, ''.join([c[0] for c in countries]))), bbox_inches='tight', dpi=300)
-	fig3.savefig(os.path.join(ws.folders['website/static/images'], 'custom_aceleracion_%i_%s_v2.png'%(n, ''.join([c[0] for c in countries]))), bbox_inches='tight', dpi=300)
+	fig1.savefig(os.path.join(ws.folders['website/static/images'], 'custom_casos_%i_%s_v2.png'%(n, label)), bbox_inches='tight', dpi=300)
+	fig2.savefig(os.path.join(ws.folders['website/static/images'], 'custom_velocidad_%i_%s_v4.png'%(n, label)), bbox_inches='tight', dpi=300)
+	fig3.savefig(os.path.join(ws.folders['website/static/images'], 'custom_aceleracion_%i_%s_v2.png'%(n, label)), bbox_inches='tight', dpi=300)
 	# plt.show()
 
 def horizontal_bar_plot(variable, df, country='world'):
@@ -670,15 +710,15 @@ def horizontal_bar_plot(variable, df, country='world'):
 	  # p.rect(x=v/2, y=j+0.5, source=df, width=abs(v), height=0.4,color=(76,114,176), width_units="data", height_units="data")
 	  j += 1
 
-	output_file(os.path.join(ws.folders["website/static/images"], "%s_hbarplot.html"%country.lower()))
+	path = os.path.join(ws.folders["website/static/images"], "%s_hbarplot.html"%country.lower())
 	# show(p)
-	save(p)
+	export.save_figure(p, path)
 
 def top_n_time_series(df, n=10, key_groupby='country_region', dates='date', variable='confirmed', label='country_region', title='', region_label='world', logscale=False):
 	""" Show time series of the top 5 countries/regions/provinces in a dataset """
 
 	# Show the top 10 provinces
-	top_5 = top_n(df, n=5, groupby=[key_groupby])
+	top_5 = top_n(df, n=5, groupby=[key_groupby], dates=dates, variable=variable)
 
 	# Show graph
 	plt.close('all')
@@ -743,6 +783,6 @@ def top_n_time_series(df, n=10, key_groupby='country_region', dates='date', vari
 	# p.x_range = Range1d(dates_[0], dates_[-1])
 
 	# Output to static HTML file
-	output_file(os.path.join(ws.folders['website/static/images'], filename.replace('.png', '.html')))
+	path = os.path.join(ws.folders['website/static/images'], filename.replace('.png', '.html'))
 	# show(p)
-	save(p)
\ No newline at end of file
+	export.save_figure(p, path)
\ No newline at end of file
@@ -18,6 +18,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 Contain useful functions
 """
 import math
+import struct
 import numpy as np
 from datetime import datetime
 import matplotlib.pyplot as plt
@@ -27,6 +28,12 @@ def str2date(s, format_):
 	""" Convert a date from str to datetime.date object """
 	return datetime.strptime(s, format_).date()
 
+def to_datetime64(date, format_='%d/%m/%Y'):
+	""" Convert a date given as a string (in 'format_'), a date object or a datetime64 to datetime64[D] """
+	if isinstance(date, str):
+		date = str2date(date, format_)
+	return np.datetime64(date, 'D')
+
 def sort_by_date(dates, x):
 	""" Sort a list/array of indices or data by their corresponding dates """
 	dates_ = sorted(dates)
@@ -66,4 +73,36 @@ def round_down_order(x, order=0):
 	""" Round x to the closest lower number of order 'order' """
 	factor = 10 ** order
 	reduced = x / factor
-	return math.floor(reduced) * factor
\ No newline at end of file
+	return math.floor(reduced) * factor
+
+def read_dbf_column(path, field, encoding='utf-8'):
+	""" Read the values of a text field from a dBase (.dbf) file, such as the attribute table of a shapefile.
+	This avoids loading the geometries when only some names are needed """
+	with open(path, 'rb') as f:
+		header = f.read(32)
+		nrecords, header_length, record_length = struct.unpack('<IHH', header[4:12])
+		# Field descriptors: 32 bytes each, until the terminator 0x0D
+		offset = 1
+		position = None
+		while True:
+			descriptor = f.read(32)
+			if descriptor[:1] == b'\r':
+				break
+			name = descriptor[:11].split(b'\x00')[0].decode('ascii')
+			length = descriptor[16]
+			if name == field:
+				position = (offset, length)
+			offset += length
+		if position is None:
+			raise KeyError(field)
+		# Records
+		f.seek(header_length)
+		start, length = position
+		values = []
+		for _ in range(nrecords):
+			record = f.read(record_length)
+			# Skip deleted records
+			if record[:1] == b'*':
+				continue
+			values.append(record[start:start + length].decode(encoding).rstrip())
+	return values
\ No newline at end of file
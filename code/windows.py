@@ -0,0 +1,54 @@
+"""
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+windows.py:
+Statistics over rolling windows of days (7, 14, 28...), computed with cumulative sums.
+All the functions work along the last axis, so a 2D array (countries x dates) is processed in one call
+"""
+import numpy as np
+
+
+
+def new_cases(x):
+	""" Daily new cases of the cumulative series in 'x'. The first day has 0 new cases """
+	x = np.asarray(x)
+	new = np.zeros_like(x)
+	new[..., 1:] = x[..., 1:] - x[..., :-1]
+	return new
+
+def rolling_sum(x, window=7):
+	""" Sum over the last 'window' days (the current one included).
+	The first 'window - 1' days sum over the days available. O(n) regardless of the window length """
+	c = np.cumsum(x, axis=-1)
+	out = c.copy()
+	out[..., window:] -= c[..., :-window]
+	return out
+
+def rolling_mean(x, window=7, integer=False):
+	""" Mean over the last 'window' days. The first 'window - 1' days are divided by 'window' too.
+	If 'integer', use integer (floor) division, like the old 7-day averages of the web site """
+	s = rolling_sum(x, window)
+	if integer:
+		return s // window
+	return s / window
+
+def per_capita(x, population, per=100000):
+	""" Values of 'x' per 'per' inhabitants. 'population' has one value per row of 'x' (or a single value) """
+	population = np.asarray(population, dtype=float)
+	if population.ndim > 0:
+		population = population[..., np.newaxis]
+	return np.asarray(x) * (per / population)
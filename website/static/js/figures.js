@@ -0,0 +1,128 @@
+/*
+Coronavirus en Gráficos: un sitio web donde entender la evolución de la pandemia.
+Copyright (C) 2020  Miguel Capllonch Juan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+figures.js:
+Embed the Bokeh figures saved as JSON items. Each <div class="bokeh-figure" id="..." data-src="...json">
+is fetched and embedded when it gets close to the visible part of the page.
+If the div has a data-data attribute, the figure was saved without its data (see code/export.py):
+its data sources and title are filled in from that file. If that data was downsampled ("full": true),
+the full data (.full.data.json) is loaded the first time the user zooms or pans the figure
+(not when the ranges change on their own).
+*/
+(function () {
+	function embed(element) {
+		if (element.dataset.loaded) {
+			return;
+		}
+		element.dataset.loaded = "1";
+		var requests = [fetch(element.dataset.src).then(function (response) { return response.json(); })];
+		if (element.dataset.data) {
+			requests.push(fetch(element.dataset.data).then(function (response) { return response.json(); }));
+		}
+		Promise.all(requests)
+			.then(function (results) {
+				return Promise.resolve(Bokeh.embed.embed_item(results[0], element.id)).then(function () {
+					if (results.length > 1) {
+						fill(results[1]);
+						if (results[1].full) {
+							load_full_on_zoom(element, results[1]);
+						}
+					}
+				});
+			})
+			.catch(function (error) { console.error("Figure " + element.dataset.src + " could not be loaded", error); });
+	}
+
+	function find_model(name) {
+		for (var i = 0; i < Bokeh.documents.length; i++) {
+			var model = Bokeh.documents[i].get_model_by_name(name);
+			if (model) {
+				return model;
+			}
+		}
+		return null;
+	}
+
+	function figure_of(data) {
+		var names = Object.keys(data.sources);
+		return names.length > 0 ? find_model(names[0].split("/")[0] + "/figure") : null;
+	}
+
+	function load_full_on_zoom(element, data) {
+		// The ranges also change on their own (auto-ranging after fill), so only the changes that follow
+		// a pan, zoom or scroll of the user in the figure load the full data
+		var figure = figure_of(data);
+		if (!figure || !figure.x_range) {
+			return;
+		}
+		var loaded = false;
+		var interacting = false;
+		function user_input() {
+			interacting = true;
+		}
+		["wheel", "mousedown", "touchstart", "keydown"].forEach(function (type) {
+			element.addEventListener(type, user_input, {passive: true});
+		});
+		try {
+			figure.connect(figure.x_range.change, function () {
+				if (loaded || !interacting) {
+					return;
+				}
+				loaded = true;
+				fetch(element.dataset.data.replace(".data.json", ".full.data.json"))
+					.then(function (response) { return response.json(); })
+					.then(fill)
+					.catch(function (error) { console.error("Full data of " + element.dataset.src + " could not be loaded", error); });
+			});
+		} catch (error) {
+			console.error("Figure " + element.dataset.src + " cannot load its full data", error);
+		}
+	}
+
+	function fill(data) {
+		Object.keys(data.sources).forEach(function (name) {
+			var source = find_model(name);
+			if (source) {
+				source.data = data.sources[name];
+			}
+		});
+		// The title goes with the data, since it usually has the date
+		if (data.title !== null) {
+			var figure = figure_of(data);
+			if (figure && figure.title) {
+				figure.title.text = data.title;
+			}
+		}
+	}
+
+	document.addEventListener("DOMContentLoaded", function () {
+		var elements = document.querySelectorAll(".bokeh-figure[data-src]");
+		if (!("IntersectionObserver" in window)) {
+			elements.forEach(embed);
+			return;
+		}
+		var observer = new IntersectionObserver(function (entries) {
+			entries.forEach(function (entry) {
+				if (entry.isIntersecting) {
+					observer.unobserve(entry.target);
+					embed(entry.target);
+				}
+			});
+		}, {rootMargin: "300px"});
+		elements.forEach(function (element) { observer.observe(element); });
+	});
+})();
@@ -21,6 +21,9 @@ Main script to run the web app.
 import os
 import time
 import flask
+from markupsafe import Markup
+import bokeh
+from bokeh.resources import Resources
 
 # from forms import ParamsForm
 import config
@@ -35,6 +38,31 @@ app = flask.Flask(__name__)
 # Security
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
+def bokeh_version():
+	""" Version of Bokeh that exported the figures (written by code/export.py), or the installed one if it is unknown """
+	try:
+		with open(os.path.join(app.static_folder, 'data', 'bokeh_version.txt'), 'r') as f:
+			return f.read().strip()
+	except OSError:
+		return bokeh.__version__
+
+@app.context_processor
+def bokeh_resources():
+	""" BokehJS from the CDN, in the version that exported the figures (used by includes/_bokehjs.html) """
+	return {'bokehjs': Markup(Resources(mode='cdn', version=bokeh_version()).render_js())}
+
+@app.context_processor
+def figure_helpers():
+	""" Helpers for the divs of the figures (see static/js/figures.js) """
+	def data_attribute(figure):
+		""" data-data attribute of the div of 'figure' (a .json path in static), pointing to its data file.
+		Empty if the figure was not saved split (see code/export.py), so the page only embeds the .json """
+		data = figure.replace('.json', '.data.json')
+		if not os.path.exists(os.path.join(app.static_folder, data)):
+			return ''
+		return Markup('data-data="%s"'%flask.url_for('static', filename=data))
+	return {'data_attribute': data_attribute}
+
 # Read contents
 read_contents.read_folders()
 read_contents.read_contents()
@@ -58,13 +86,14 @@ def home():
 		read_contents.read_contents()
 		read_contents.read_static_data()
 
-	# Figures to show on the Home page
+	# Figures to show on the Home page (JSON items, embedded by static/js/figures.js)
 	figures = {
-		"world_graph": "images/world_graph.html", 
-		"world_map": "images/world_map_log.html", 
-		"top_ten_growth": "images/new_7_days_vs_date_top_n10_.html", 
-		"top_ten_growth_log": "images/new_7_days_vs_date_top_n10_logscale.html", 
-		"top_ten_growth_vs_active_log": "images/new_vs_active_last7days_top_n10_logscale.html", 
+		"world_graph": "images/world_graph.json", 
+		"world_map": "images/world_map_log.json", 
+		"world_map_animated": "images/world_map_animated_log.json", 
+		"top_ten_growth": "images/new_7_days_vs_date_top_n10_.json", 
+		"top_ten_growth_log": "images/new_7_days_vs_date_top_n10_logscale.json", 
+		"top_ten_growth_vs_active_log": "images/new_vs_active_last7days_top_n10_logscale.json", 
 	}
 	return flask.render_template(
 			'home.html', 
@@ -78,7 +107,7 @@ def spain_specific():
 	return flask.render_template(
 			'spain_specific.html', 
 			content=ws.contents, 
-			figure="images/spain_graph.html", 
+			figure="images/spain_graph.json", 
 		)
 
 @app.route('/colombia_specific', methods=['GET', 'POST'])
@@ -87,7 +116,7 @@ def colombia_specific():
 	return flask.render_template(
 			'colombia_specific.html', 
 			content=ws.contents, 
-			figure="images/colombia_graph.html", 
+			figure="images/colombia_graph.json", 
 		)
 	
 # Graphs page